@@ -2,21 +2,22 @@ import os
 import sys
 import time
 import pyautogui
-import ctypes
-import cv2
-import numpy as np
-import mss
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QPoint
+from metrics import DISABLED, Metrics
+from frame_recorder import FrameRecorder
+from journal import EventJournal
+from multi_matcher import MatchWatch, MultiMatchRunner, publish_match_result
+from process_backend import ProcessMatchBackend, WatchSpec
+from click_scheduler import ClickTarget, MultiTargetRunner, compile_schedule
+from clocks import SYSTEM_CLOCK
+from telemetry import RenderCache, Telemetry, format_elapsed
+from template_store import get_default_store
+from input_backend import precise_click
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QPoint
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLabel, QFileDialog, QGridLayout, QShortcut)
 from PyQt5.QtGui import QCursor, QPainter, QPen, QBrush, QColor, QImage, QKeySequence
 
-
-# 高性能点击函数
-def precise_click(x, y):
-    ctypes.windll.user32.SetCursorPos(x, y)
-    ctypes.windll.user32.mouse_event(0x0002, 0, 0, 0, 0)  # 按下左键
-    ctypes.windll.user32.mouse_event(0x0004, 0, 0, 0, 0)  # 释放左键
+CLICK_TARGET = "main"  # 界面只有一个点击目标，遥测和事件日志中以此标识
 
 
 # 区域选择窗口
@@ -74,97 +75,121 @@ class SnipWidget(QWidget):
             self.close()
 
 
-# 模板匹配检测线程
+# 模板匹配检测线程：单个监视项的 MultiMatchRunner，持续匹配时发出信号
 class TemplateMatcherThread(QThread):
-    match_status_signal = pyqtSignal(bool)
-    matched_5s_signal = pyqtSignal()  # 新增信号，当匹配持续5秒时触发
+    matched_5s_signal = pyqtSignal(float)  # 当匹配持续5秒时触发，参数为检测时刻（单调时钟）
 
-    def __init__(self, region, template_gray, threshold):
+    def __init__(self, region, template_gray, threshold, match_mode="auto", change_gate=True, track_roi=True,
+                 telemetry=None, capture_factory=None, record_path=None, record_capacity=3000, metrics=None,
+                 template_entry=None, prefilter=None, workers=1, cpu_budget=0.5, clock=None,
+                 journal=None, poll_cpu_budget=0.25):
         super().__init__()
-        self.region = region
-        self.template_gray = template_gray
-        self.threshold = threshold
+        self.region = tuple(region)
+        # 监视项名称即事件日志中的模板标识：缓存条目的内容哈希，截图模板没有条目时为 "template"
+        name = template_entry.key if template_entry is not None else "template"
+        watch = MatchWatch(name, template_gray, region, threshold, 5, match_mode, track_roi,  # 匹配持续5秒时触发
+                           template_entry=template_entry, prefilter=prefilter, workers=workers,
+                           cpu_budget=cpu_budget, change_gate=change_gate)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.runner = MultiMatchRunner([watch], telemetry=self.telemetry,
+                                       on_persistent=lambda result, now: self.matched_5s_signal.emit(now),
+                                       capture_factory=capture_factory, metrics=metrics, journal=journal,
+                                       poll_cpu_budget=poll_cpu_budget, clock=clock)
+        # 录制检测到的区域帧，误触发时可离线回放（frame_recorder.py）
+        self.record_path = record_path
+        self.record_capacity = record_capacity
+
+    def run(self):
+        x1, y1, x2, y2 = self.region
+        recorder = None
+        if self.record_path:
+            recorder = FrameRecorder(self.record_path, (y2 - y1, x2 - x1), self.record_capacity, self.region)
+            self.runner.engine.recorders[self.region] = recorder
+        try:
+            self.runner.run()
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+    def stop(self):
+        self.runner.stop()
+
+
+# 多进程匹配适配线程：截图和匹配在子进程中完成，本线程只转发结果，信号与 TemplateMatcherThread 一致
+class ProcessMatcherThread(QThread):
+    matched_5s_signal = pyqtSignal(float)
+
+    def __init__(self, specs, workers=2, poll_interval=0.1, telemetry=None):
+        super().__init__()
+        self.backend = ProcessMatchBackend(specs, workers, poll_interval)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
         self.running = False
-        self.match_start_time = None  # 新增：记录开始匹配的时间
 
     def run(self):
         self.running = True
-        with mss.mss() as sct:
+        self.backend.start()
+        try:
             while self.running:
-                x1, y1, x2, y2 = self.region
-                width, height = x2 - x1, y2 - y1
-                img = np.array(sct.grab({"top": y1, "left": x1, "width": width, "height": height}))
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                res = cv2.matchTemplate(gray, self.template_gray, cv2.TM_CCOEFF_NORMED)
-                max_val = cv2.minMaxLoc(res)[1]
-
-                if max_val >= self.threshold:
-                    if self.match_start_time is None:
-                        self.match_start_time = time.time()  # 第一次检测到匹配时记录时间
-                    elif time.time() - self.match_start_time >= 5:  # 持续5秒
-                        self.matched_5s_signal.emit()  # 发送信号
-                        self.match_start_time = None  # 重置计时器
-                else:
-                    self.match_start_time = None  # 匹配中断则重置计时器
-
-                self.match_status_signal.emit(max_val >= self.threshold)
-                time.sleep(0.1)
+                batch = self.backend.get_results(timeout=0.2)
+                if batch is None:
+                    continue
+                timestamp, results = batch
+                if any(r.persistent for r in results):
+                    self.matched_5s_signal.emit(timestamp)
+                self.telemetry.set("match.matched", any(r.matched for r in results))
+                for result in results:
+                    publish_match_result(self.telemetry, result)
+        finally:
+            self.backend.stop()
 
     def stop(self):
         self.running = False
 
 
-# 点击引擎
+# 点击引擎：单个目标的 MultiTargetRunner，检测线程的匹配事件触发立即点击并重置时间节点
 class PrecisionClickEngine(QThread):
     status_update = pyqtSignal(str)
-    time_update = pyqtSignal(str)
-    click_count_update = pyqtSignal(int)
-    next_click_update = pyqtSignal(str)
 
-    def __init__(self, click_pos, interval_pattern):
+    def __init__(self, click_pos, interval_pattern, match_reset_pattern=None, telemetry=None, metrics=None,
+                 clock=None, journal=None):
         super().__init__()
-        self.running = False
         self.click_pos = click_pos
-        self.interval_pattern = interval_pattern
-        self.current_index = 0
-        self.next_click_time = 0
-        self.start_timestamp = 0
-        self.click_counter = 0
+        self.interval_pattern = list(interval_pattern)  # 复制一份，界面修改自己的列表不影响运行中的引擎
+        # 匹配持续5秒后重置成的时间节点，预先编译成不可变时间表，检测线程直接传引用
+        reset_pattern = match_reset_pattern if match_reset_pattern is not None else interval_pattern
+        self.match_reset_schedule = compile_schedule(reset_pattern) if reset_pattern else None
+        clock = clock if clock is not None else SYSTEM_CLOCK  # 可注入虚拟时钟
+        # 时间节点为空时在 run 中报错
+        targets = []
+        if self.interval_pattern:
+            targets.append(ClickTarget(CLICK_TARGET, click_pos, self.interval_pattern, clock=clock))
+        # 运行时长、点击次数、下次点击时间只写入遥测，由界面按自己的刷新率显示
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.runner = MultiTargetRunner(precise_click, targets, self.telemetry,
+                                        on_error=lambda target_id, message: self.status_update.emit(f"错误: {message}"),
+                                        metrics=metrics, clock=clock, journal=journal, on_trigger=self.on_trigger)
 
     def run(self):
         if not self.interval_pattern:
             self.status_update.emit("错误: 没有设置时间节点")
             return
-
-        self.running = True
-        self.start_timestamp = time.time()
-        self.next_click_time = self.start_timestamp + self.interval_pattern[0]
-        self.current_index = 0
-        self.click_counter = 0
-
         try:
-            while self.running:
-                current_time = time.time()
-                elapsed = int(current_time - self.start_timestamp)
-                self.time_update.emit(f"{elapsed // 3600:02d}:{(elapsed % 3600) // 60:02d}:{elapsed % 60:02d}")
-
-                # 更新下一次点击时间
-                next_click_in = max(0, self.next_click_time - current_time)
-                self.next_click_update.emit(f"{next_click_in:.1f}秒")
-
-                if current_time >= self.next_click_time:
-                    precise_click(*self.click_pos)
-                    self.click_counter += 1
-                    self.click_count_update.emit(self.click_counter)
-                    self.current_index = (self.current_index + 1) % len(self.interval_pattern)
-                    self.next_click_time += self.interval_pattern[self.current_index]
-
-                time.sleep(0.1)
+            self.runner.run()
         except Exception as e:
             self.status_update.emit(f"错误: {str(e)}")
 
+    def on_trigger(self, target_id, detected_at, clicked_at, schedule):
+        self.status_update.emit(
+            f"检测到匹配持续5秒，已立即点击 (延迟 {(clicked_at - detected_at) * 1000:.1f}ms)\n"
+            f"重置时间节点为: {schedule}")
+
+    def on_match_event(self, detected_at):
+        """匹配持续5秒，直接在检测线程中调用（不经过 Qt 事件循环）"""
+        if self.runner.running and self.match_reset_schedule is not None:
+            self.runner.trigger(CLICK_TARGET, detected_at, self.match_reset_schedule)
+
     def stop(self):
-        self.running = False
+        self.runner.stop()
 
 
 # 主窗口
@@ -177,12 +202,35 @@ class AutoClickerWindow(QWidget):
         self.match_region = None
         self.template_gray = None
         self.match_threshold = 0.9
+        self.match_mode = "auto"  # 匹配模式: auto / full / pyramid / fft
+        self.change_gate = True  # 画面未变化时复用上次的匹配结果
+        self.track_roi = True  # 命中后优先在上次位置附近搜索
+        self.prefilter = None  # 完整匹配前的预筛选阶段，例如 ("histogram", "variance", "coarse")
+        self.match_workers = 4  # 大区域分块并行匹配的线程数
+        self.match_cpu_budget = 0.5  # 并行匹配最多占用的核心比例，避免挤占点击线程
+        self.poll_cpu_budget = 0.25  # 检测线程自身最多占用单个核心的比例，超出时拉长轮询间隔（0 为不限制）
+        self.use_process_backend = False  # 截图和匹配放到子进程中运行
+        self.record_path = None  # 设置后把检测区域的帧录制到该文件（环形，最多 record_capacity 帧）
+        self.record_capacity = 3000
+        self.ui_refresh_hz = 10  # 界面刷新率，引擎状态只在刷新时格式化
+        self.metrics_enabled = False  # 统计各阶段耗时，停止时写入 metrics_path
+        self.metrics_path = "metrics.json"
+        self.metrics_port = None  # 设置后运行期间可通过 http://127.0.0.1:端口/ 查看实时统计
+        self.metrics = DISABLED
+        self.journal_dir = None  # 设置后把每次点击和每帧匹配得分写入该目录下的事件日志（journal.py）
+        self.journal = None
+        self.telemetry = Telemetry()
+        self.telemetry_version = 0
+        self.render_cache = RenderCache()
+        self.ui_timer = QTimer(self)
+        self.ui_timer.timeout.connect(self.refresh_telemetry)
         self.matcher_thread = None
         self.is_topmost = True
         self.original_interval_pattern = [9, 10]  # 新增：保存原始时间节点
 
         self.default_template_path = "test.png"  # 添加默认图片路径
         self.template_gray = None
+        self.template_entry = None  # 模板缓存条目，包含预先算好的金字塔等派生数据
 
         # 添加快捷键
         self.shortcut_set_pos = QShortcut(QKeySequence("F8"), self)
@@ -238,6 +286,10 @@ class AutoClickerWindow(QWidget):
         self.match_status_label.setStyleSheet("font: bold 16px;")
         data_layout.addWidget(self.match_status_label, 2, 0, 1, 4)
 
+        # 第四行：启用预筛选时显示各阶段排除的帧数
+        self.prefilter_display = QLabel("")
+        data_layout.addWidget(self.prefilter_display, 3, 0, 1, 4)
+
         main_layout.addLayout(data_layout)
 
         # 按钮样式 - 大按钮
@@ -313,11 +365,11 @@ class AutoClickerWindow(QWidget):
         """尝试加载默认模板图片"""
         try:
             if os.path.exists(self.default_template_path):
-                template = cv2.imread(self.default_template_path, cv2.IMREAD_COLOR)
-                if template is not None:
-                    self.template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+                # 按文件内容哈希命中缓存时跳过解码和预处理
+                try:
+                    self.set_template(get_default_store().load(self.default_template_path))
                     self.status_display.setText(f"已自动加载默认模板: {self.default_template_path}")
-                else:
+                except ValueError:
                     self.status_display.setText("默认模板加载失败（图片可能损坏）")
             else:
                 self.status_display.setText("未找到默认模板图片 test.png")
@@ -344,22 +396,47 @@ class AutoClickerWindow(QWidget):
         )
         if path:
             try:
-                template = cv2.imread(path, cv2.IMREAD_COLOR)
-                if template is None:
+                try:
+                    entry = get_default_store().load(path)
+                except ValueError:
                     self.status_display.setText("模板图片加载失败")
                     return
-                self.template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+                self.set_template(entry)
                 self.status_display.setText(f"模板已加载: {path}")
             except Exception as e:
                 self.status_display.setText(f"加载模板出错: {str(e)}")
 
+    def set_template(self, entry):
+        self.template_entry = entry
+        self.template_gray = entry.gray
+
     def toggle_operation(self):
         if self.click_engine and self.click_engine.isRunning():
             self.stop_operation()
             self.status_display.setText("操作已停止 (F9快捷键)")
         else:
-            self.start_operation()
+            # 先显示运行状态，启动过程中的错误和警告会覆盖它
             self.status_display.setText("运行中... (F9停止)")
+            self.start_operation()
+
+    def refresh_telemetry(self):
+        """按刷新率拉取遥测中的变化字段，文本未变化时不调用 setText"""
+        self.telemetry_version, changed = self.telemetry.changes(self.telemetry_version)
+        now = time.monotonic()
+        start_time = self.telemetry.get("clicks.start_time")
+        if start_time is not None:
+            self.render_cache.update("time", format_elapsed(now - start_time), self.time_display.setText)
+        next_deadline = self.telemetry.get(("click", CLICK_TARGET, "next_deadline"))
+        if next_deadline is not None:
+            self.render_cache.update("next", f"{max(0, next_deadline - now):.1f}秒", self.next_click_display.setText)
+        if ("click", CLICK_TARGET, "count") in changed:
+            self.update_click_count(changed[("click", CLICK_TARGET, "count")])
+        if "match.matched" in changed:
+            self.update_match_status(changed["match.matched"])
+        for field, value in changed.items():
+            if isinstance(field, tuple) and field[-1] == "prefilter":
+                rejected = "  ".join(f"{stage} {count}" for stage, count in value["rejected"].items())
+                self.prefilter_display.setText(f"预筛选: 通过 {value['passed']}/{value['frames']} 帧，排除 {rejected}")
 
     def update_match_status(self, matched):
         if matched:
@@ -374,67 +451,96 @@ class AutoClickerWindow(QWidget):
             self.status_display.setText("错误: 请先设置鼠标位置")
             return
 
-        # 启动模板匹配线程
-        if self.match_region and self.template_gray is not None:
-            self.matcher_thread = TemplateMatcherThread(self.match_region, self.template_gray, self.match_threshold)
-            self.matcher_thread.match_status_signal.connect(self.update_match_status)
-            self.matcher_thread.matched_5s_signal.connect(self.on_matched_5s)  # 连接新信号
-            self.matcher_thread.start()
+        if self.journal_dir:
+            try:
+                self.journal = EventJournal(self.journal_dir)
+            except OSError as e:
+                self.status_display.setText(f"错误: 事件日志目录无法创建 {str(e)}")
+                return
+
+        # 每次运行使用新的遥测状态，界面按 ui_refresh_hz 拉取
+        self.telemetry = Telemetry()
+        self.telemetry_version = 0
+        self.ui_timer.start(int(1000 / self.ui_refresh_hz))
+        self.metrics = Metrics(self.metrics_enabled)
+        warning = ""
+        if self.metrics_enabled and self.metrics_port is not None:
+            try:
+                self.metrics.serve(self.metrics_port)
+            except OSError as e:
+                # 端口被占用等情况下不启动实时统计，点击和检测照常运行，警告附在运行状态后面
+                warning = f"  实时统计端口 {self.metrics_port} 无法监听: {str(e)}"
 
         # 启动点击引擎
-        self.click_engine = PrecisionClickEngine(self.click_pos, self.interval_pattern)
+        self.click_engine = PrecisionClickEngine(self.click_pos, self.interval_pattern,
+                                                 match_reset_pattern=self.original_interval_pattern,
+                                                 telemetry=self.telemetry, metrics=self.metrics,
+                                                 journal=self.journal)
         self.click_engine.status_update.connect(self.update_status)
-        self.click_engine.time_update.connect(self.update_time)
-        self.click_engine.click_count_update.connect(self.update_click_count)
-        self.click_engine.next_click_update.connect(self.update_next_click)
         self.click_engine.start()
 
+        # 启动模板匹配线程
+        if self.match_region and self.template_gray is not None:
+            if self.use_process_backend:
+                spec = WatchSpec("default", self.template_gray, self.match_region, self.match_threshold,
+                                 5, self.match_mode)
+                self.matcher_thread = ProcessMatcherThread([spec], workers=1, telemetry=self.telemetry)
+            else:
+                self.matcher_thread = TemplateMatcherThread(self.match_region, self.template_gray,
+                                                            self.match_threshold, self.match_mode,
+                                                            self.change_gate, self.track_roi,
+                                                            telemetry=self.telemetry,
+                                                            record_path=self.record_path,
+                                                            record_capacity=self.record_capacity,
+                                                            metrics=self.metrics,
+                                                            template_entry=self.template_entry,
+                                                            prefilter=self.prefilter,
+                                                            workers=self.match_workers,
+                                                            cpu_budget=self.match_cpu_budget,
+                                                            journal=self.journal,
+                                                            poll_cpu_budget=self.poll_cpu_budget)
+            # 直连：在检测线程中把匹配事件送入点击引擎的命令通道，点击不依赖界面线程是否繁忙
+            self.matcher_thread.matched_5s_signal.connect(self.click_engine.on_match_event, Qt.DirectConnection)
+            self.matcher_thread.start()
+
         self.main_action_btn.setText("停止运行")
         self.main_action_btn.setStyleSheet("padding: 12px; font: bold 14px; background: #e74c3c; color: white;")
-        self.status_display.setText(f"运行中... 时间节点: {self.interval_pattern}")
-
-    # 新增方法：处理匹配持续5秒的情况
-    def on_matched_5s(self):
-        if self.click_engine and self.click_engine.isRunning():
-            # 立即点击一次
-            precise_click(*self.click_pos)
-            self.click_engine.click_counter += 1
-            self.update_click_count(self.click_engine.click_counter)
-
-            # 重置为原始时间节点 [9,10]
-            self.click_engine.interval_pattern = self.original_interval_pattern.copy()
-            self.click_engine.current_index = 0
-            self.click_engine.next_click_time = time.time() + self.original_interval_pattern[0]
-
-            self.status_display.setText(
-                f"检测到匹配持续5秒，已立即点击\n重置时间节点为: {self.original_interval_pattern}")
+        self.status_display.setText(f"运行中... 时间节点: {self.interval_pattern}{warning}")
 
     def stop_operation(self):
-        if self.click_engine:
-            self.click_engine.stop()
-            self.click_engine.wait()
-            self.click_engine = None
+        # 先停检测线程，避免它继续向已停止的点击引擎发送匹配事件
         if self.matcher_thread:
             self.matcher_thread.stop()
             self.matcher_thread.wait()
             self.matcher_thread = None
+        if self.click_engine:
+            self.click_engine.stop()
+            self.click_engine.wait()
+            self.click_engine = None
+        self.ui_timer.stop()
+        self.refresh_telemetry()
 
         self.main_action_btn.setText("开始运行")
         self.main_action_btn.setStyleSheet("padding: 12px; font: bold 14px; background: #2ecc71; color: white;")
         self.status_display.setText("操作已停止")
+        if self.metrics.enabled:
+            try:
+                self.metrics.dump(self.metrics_path)
+            except OSError as e:
+                self.status_display.setText(f"错误: 统计写入失败 {str(e)}")
+            self.metrics.close()
+            self.metrics = DISABLED
+        if self.journal is not None:
+            # 两个引擎线程都已停止，再写出剩余的缓冲
+            self.journal.close()
+            self.journal = None
 
     def update_status(self, message):
         self.status_display.setText(message)
 
-    def update_time(self, time_str):
-        self.time_display.setText(time_str)
-
     def update_click_count(self, count):
         self.count_display.setText(str(count))
 
-    def update_next_click(self, time_str):
-        self.next_click_display.setText(time_str)
-
     def toggle_window_top(self):
         self.is_topmost = not self.is_topmost
         if self.is_topmost:
@@ -0,0 +1,248 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+# 基准测试：在合成画面上无界面运行，测量检测循环各阶段耗时和点击调度抖动，
+# 结果输出为 JSON，并可与保存的基线比较，发现性能回退时返回非零退出码。
+#
+#   python benchmarks/bench.py                      运行全部用例并与 benchmarks/baseline.json 比较
+#   python benchmarks/bench.py --save-baseline      运行后把结果保存为基线
+#   python benchmarks/bench.py --quick --output r.json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from capture import SyntheticCaptureSource
+from click_scheduler import DeadlineScheduler, sleep_until
+from frame_pipeline import FramePipeline
+from input_backend import RecordingInputBackend
+from matching import MatchEvaluator, create_matcher
+
+REGION_SIZES = ((200, 200), (640, 480), (1280, 720), (1920, 1080), (3840, 2160))
+TEMPLATE_SIDES = (32, 64, 128)
+QUICK_REGION_SIZES = ((200, 200), (1280, 720))
+QUICK_TEMPLATE_SIDES = (64,)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def percentiles(samples):
+    """返回毫秒单位的 p50 / p99 / max"""
+    if not samples:
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    values = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+        "max_ms": round(float(values.max()), 4),
+    }
+
+
+def make_template(side, seed=1):
+    # 有明显结构的模板，避免与噪声背景偶然相关
+    rng = np.random.default_rng(seed)
+    template = cv2.resize(rng.integers(0, 256, (8, 8), dtype=np.uint8), (side, side),
+                          interpolation=cv2.INTER_NEAREST)
+    cv2.rectangle(template, (1, 1), (side - 2, side - 2), 255, 2)
+    return template
+
+
+def bench_match_loop(width, height, side, mode, change_gate, track_roi, frames, time_budget, prefilter=None,
+                     workers=1):
+    """按 TemplateMatcherThread 的流程（截图 -> 灰度 -> 匹配判定）逐帧计时，不含轮询间隔"""
+    template = make_template(side)
+    # 模板在前半段可见、后半段消失，两种状态都会被测到
+    script = [(0, frames * 0.05, width // 3, height // 3)]
+    source = SyntheticCaptureSource(width, height, template, script, channels=4)
+    region = (0, 0, width, height)
+    rect = {"top": 0, "left": 0, "width": width, "height": height}
+    matcher = create_matcher(template, mode, region, change_gate=change_gate,
+                             track_threshold=0.9 if track_roi else None, prefilter=prefilter, workers=workers)
+    evaluator = MatchEvaluator(matcher, 0.9)
+    pipeline = FramePipeline()
+
+    stages = {"grab": [], "convert": [], "match": [], "total": []}
+    clock = time.perf_counter
+    started = clock()
+    count = 0
+    while count < frames and (count < 3 or clock() - started < time_budget):
+        t0 = clock()
+        now = source.begin_frame()
+        frame = source.grab(rect)
+        t1 = clock()
+        gray = pipeline.to_gray(frame, key=region)
+        t2 = clock()
+        evaluator.evaluate(gray, now)
+        t3 = clock()
+        stages["grab"].append(t1 - t0)
+        stages["convert"].append(t2 - t1)
+        stages["match"].append(t3 - t2)
+        stages["total"].append(t3 - t0)
+        count += 1
+    elapsed = clock() - started
+    pipeline_stats = pipeline.stats()
+    return {
+        "region": [width, height],
+        "template": side,
+        "mode": mode,
+        "change_gate": change_gate,
+        "track_roi": track_roi,
+        "prefilter": list(prefilter or ()),
+        "workers": workers,
+        "frames": count,
+        "fps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "stages": {name: percentiles(samples) for name, samples in stages.items()},
+        # 截图到灰度图每帧拷贝的字节数（零拷贝时为 0），frame_bytes 为整帧 BGRA 的大小，可对比拷贝一次的代价
+        "copy": {
+            "avg_copy_bytes": round(pipeline_stats["avg_copy_bytes"], 1),
+            "allocated_bytes": pipeline_stats["allocated_bytes"],
+            "frame_bytes": width * height * 4,
+        },
+    }
+
+
+def _burn_cpu(stop_event):
+    while not stop_event.is_set():
+        for _ in range(10000):
+            pass
+
+
+def bench_click_jitter(interval, duration, load_workers):
+    """按 PrecisionClickEngine 的流程（截止时间调度 + 粗睡后自旋）点击，统计实际点击时刻的迟到量"""
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+    workers = [ctx.Process(target=_burn_cpu, args=(stop_event,), daemon=True) for _ in range(load_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        backend = RecordingInputBackend(clock=time.monotonic)
+        scheduler = DeadlineScheduler([interval])
+        scheduler.start()
+        end = scheduler.start_time + duration
+        while scheduler.next_deadline < end:
+            sleep_until(scheduler.next_deadline)
+            backend.click(0, 0)
+            scheduler.complete(backend.events[-1][0])
+    finally:
+        stop_event.set()
+        for worker in workers:
+            worker.join(2.0)
+    return {
+        "interval_ms": interval * 1000,
+        "load_workers": load_workers,
+        "clicks": len(backend.clicks()),
+        "skipped": scheduler.skipped,
+        "lateness": percentiles(list(scheduler.lateness)),
+    }
+
+
+def environment():
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def case_key(case):
+    return (tuple(case["region"]), case["template"], case["mode"], case["change_gate"], case["track_roi"],
+            tuple(case.get("prefilter", ())), case.get("workers", 1))
+
+
+def compare(results, baseline, tolerance, jitter_floor_ms=0.5):
+    """返回回退项列表：帧率低于基线 (1 - tolerance) 倍、每帧拷贝字节数多于基线，
+    或点击 p99 迟到超过基线 (1 + tolerance) 倍加下限"""
+    regressions = []
+    base_cases = {case_key(c): c for c in baseline.get("matching", [])}
+    for case in results.get("matching", []):
+        base = base_cases.get(case_key(case))
+        if base is None:
+            continue
+        if case["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(f"{case['region'][0]}x{case['region'][1]} 模板{case['template']} {case['mode']}: "
+                               f"帧率 {case['fps']:.1f} < 基线 {base['fps']:.1f}")
+        if "copy" in case and "copy" in base and case["copy"]["avg_copy_bytes"] > base["copy"]["avg_copy_bytes"]:
+            regressions.append(f"{case['region'][0]}x{case['region'][1]} 模板{case['template']} {case['mode']}: "
+                               f"每帧拷贝 {case['copy']['avg_copy_bytes']:.0f} 字节 > "
+                               f"基线 {base['copy']['avg_copy_bytes']:.0f} 字节")
+    click, base_click = results.get("click_jitter"), baseline.get("click_jitter")
+    if click and base_click:
+        limit = base_click["lateness"]["p99_ms"] * (1 + tolerance) + jitter_floor_ms
+        if click["lateness"]["p99_ms"] > limit:
+            regressions.append(f"点击 p99 迟到 {click['lateness']['p99_ms']:.3f}ms > 允许值 {limit:.3f}ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检测循环与点击调度基准测试")
+    parser.add_argument("--quick", action="store_true", help="只运行少量用例")
+    parser.add_argument("--modes", default="auto", help="逗号分隔的匹配模式: auto / full / pyramid / fft")
+    parser.add_argument("--change-gate", action="store_true", help="启用变化检测（合成画面多为静止帧，结果会偏乐观）")
+    parser.add_argument("--no-track-roi", action="store_true", help="关闭 ROI 跟踪")
+    parser.add_argument("--prefilter", help="逗号分隔的预筛选阶段: histogram / variance / coarse")
+    parser.add_argument("--workers", type=int, default=1, help="分块并行匹配的线程数（受 CPU 预算限制）")
+    parser.add_argument("--frames", type=int, default=40, help="每个用例最多测量的帧数")
+    parser.add_argument("--time-budget", type=float, default=5.0, help="每个用例最多运行的秒数")
+    parser.add_argument("--skip-click", action="store_true", help="跳过点击调度抖动测试")
+    parser.add_argument("--click-interval", type=float, default=0.02, help="抖动测试的点击间隔（秒）")
+    parser.add_argument("--click-duration", type=float, default=5.0, help="抖动测试时长（秒）")
+    parser.add_argument("--load-workers", type=int, default=os.cpu_count() or 1, help="制造 CPU 负载的进程数")
+    parser.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线 JSON 路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对回退比例")
+    args = parser.parse_args(argv)
+
+    regions = QUICK_REGION_SIZES if args.quick else REGION_SIZES
+    sides = QUICK_TEMPLATE_SIDES if args.quick else TEMPLATE_SIDES
+    results = {"environment": environment(), "matching": []}
+    for mode in args.modes.split(","):
+        for width, height in regions:
+            for side in sides:
+                case = bench_match_loop(width, height, side, mode, args.change_gate, not args.no_track_roi,
+                                        args.frames, args.time_budget,
+                                        args.prefilter.split(",") if args.prefilter else None, args.workers)
+                results["matching"].append(case)
+                total = case["stages"]["total"]
+                print(f"{width}x{height} 模板{side} {mode}: {case['fps']:.1f} fps  "
+                      f"p50 {total['p50_ms']:.2f}ms  p99 {total['p99_ms']:.2f}ms  "
+                      f"每帧拷贝 {case['copy']['avg_copy_bytes']:.0f}/{case['copy']['frame_bytes']} 字节", file=sys.stderr)
+    if not args.skip_click:
+        click = bench_click_jitter(args.click_interval, args.click_duration, args.load_workers)
+        results["click_jitter"] = click
+        print(f"点击抖动（{click['load_workers']} 个负载进程）: p50 {click['lateness']['p50_ms']:.3f}ms  "
+              f"p99 {click['lateness']['p99_ms']:.3f}ms  max {click['lateness']['max_ms']:.3f}ms", file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"基线已保存到 {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("未找到基线文件，跳过比较（可使用 --save-baseline 生成）", file=sys.stderr)
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"性能回退: {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
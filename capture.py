@@ -0,0 +1,191 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from frame_pipeline import bgra_view
+
+
+# 回放来源的帧已经全部读完
+class ReplayFinished(Exception):
+    pass
+
+
+# 截图来源接口：begin_frame 开始新一轮并返回该轮的时间戳，grab 返回区域图像（BGRA 或灰度）
+class CaptureSource:
+    monitors = []
+
+    def begin_frame(self):
+        return time.monotonic()
+
+    def grab(self, rect):
+        """rect 为 mss 风格的 {"left", "top", "width", "height"}，返回的数组在下一次 grab 前有效"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# 实时屏幕截图
+class MssCaptureSource(CaptureSource):
+    def __init__(self):
+        import mss
+        self.sct = mss.mss()
+        self.monitors = self.sct.monitors
+
+    def grab(self, rect):
+        return bgra_view(self.sct.grab(rect))
+
+    def close(self):
+        self.sct.close()
+
+
+def _virtual_monitors(width, height):
+    mon = {"left": 0, "top": 0, "width": width, "height": height}
+    return [dict(mon), dict(mon)]
+
+
+# 合成画面：固定噪声背景，按脚本在指定时间段把模板画到指定位置；默认使用虚拟时间，不受实时限制
+class SyntheticCaptureSource(CaptureSource):
+    def __init__(self, width, height, template_gray, script=(), frame_interval=0.1, seed=0, realtime=False,
+                 channels=1, clock=None):
+        """script 为 [(开始秒, 结束秒, x, y), ...]，时间从第一帧开始计算；channels=4 时输出与 mss 相同的 BGRA。
+        begin_frame 返回 clock（默认单调时钟）上的时间戳；非实时模式下每帧前进 frame_interval，
+        clock 为虚拟时钟时同时推进该时钟"""
+        rng = np.random.default_rng(seed)
+        # 轻微模糊的噪声更接近真实界面，避免模板与噪声偶然高度相关
+        self.background = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (5, 5), 0)
+        self.template_gray = template_gray
+        if channels == 4:
+            self.background = cv2.cvtColor(self.background, cv2.COLOR_GRAY2BGRA)
+            self.template_gray = cv2.cvtColor(template_gray, cv2.COLOR_GRAY2BGRA)
+        self.script = list(script)
+        self.frame_interval = frame_interval
+        self.realtime = realtime
+        self.clock = clock if clock is not None else time.monotonic
+        self.monitors = _virtual_monitors(width, height)
+        self.frame_index = -1
+        self.start_time = None
+        self.now = 0.0  # 本帧时间戳
+        self.elapsed = 0.0  # 距第一帧的秒数，脚本按它判断模板是否可见
+        self.buffers = {}
+
+    def begin_frame(self):
+        self.frame_index += 1
+        if self.start_time is None:
+            self.start_time = self.clock()
+        if self.realtime:
+            self.now = self.clock()
+            self.elapsed = self.now - self.start_time
+        else:
+            self.elapsed = self.frame_index * self.frame_interval
+            self.now = self.start_time + self.elapsed
+            if getattr(self.clock, "virtual", False):
+                self.clock.advance_to(self.now)
+        return self.now
+
+    def visible(self, elapsed=None):
+        """返回脚本时间 elapsed（默认为本帧）模板所在的位置列表"""
+        elapsed = self.elapsed if elapsed is None else elapsed
+        return [(x, y) for start, end, x, y in self.script if start <= elapsed < end]
+
+    def grab(self, rect):
+        left, top, width, height = rect["left"], rect["top"], rect["width"], rect["height"]
+        out = self.buffers.get((width, height))
+        if out is None:
+            out = np.empty((height, width) + self.background.shape[2:], dtype=np.uint8)
+            self.buffers[(width, height)] = out
+        np.copyto(out, self.background[top:top + height, left:left + width])
+        th, tw = self.template_gray.shape[:2]
+        for x, y in self.visible():
+            # 只画与截图区域相交的部分
+            x0, y0 = max(x, left), max(y, top)
+            x1, y1 = min(x + tw, left + width), min(y + th, top + height)
+            if x0 < x1 and y0 < y1:
+                out[y0 - top:y1 - top, x0 - left:x1 - left] = self.template_gray[y0 - y:y1 - y, x0 - x:x1 - x]
+        return out
+
+
+# 回放已录制的帧：每轮取下一帧，时间戳使用录制时的时间
+class ReplayCaptureSource(CaptureSource):
+    def __init__(self, frames, timestamps=None, origin=(0, 0), loop=False, source=None):
+        """frames 为帧数组序列，origin 为帧左上角对应的屏幕坐标，source 为帧来自的文件或目录（用于错误信息）"""
+        if len(frames) == 0:
+            raise ValueError(f"没有可回放的帧: {source}" if source else "没有可回放的帧")
+        self.frames = frames
+        self.timestamps = timestamps
+        self.origin = origin
+        self.loop = loop
+        self.index = -1
+        first = frames[0]
+        self.monitors = [{"left": origin[0], "top": origin[1], "width": first.shape[1], "height": first.shape[0]}] * 2
+
+    @classmethod
+    def from_directory(cls, path, frame_interval=0.1, origin=(0, 0), loop=False):
+        """读取目录中按文件名排序的 .png/.bmp/.npy 帧"""
+        names = sorted(n for n in os.listdir(path) if n.lower().endswith((".png", ".bmp", ".npy")))
+        if not names:
+            raise ValueError(f"目录中没有可回放的帧: {path}")
+        frames = []
+        for name in names:
+            full = os.path.join(path, name)
+            frame = np.load(full) if name.endswith(".npy") else cv2.imread(full, cv2.IMREAD_GRAYSCALE)
+            if frame is None:
+                raise ValueError(f"帧读取失败: {full}")
+            frames.append(frame)
+        return cls(frames, [i * frame_interval for i in range(len(frames))], origin, loop, path)
+
+    @classmethod
+    def from_recording(cls, path, loop=False):
+        """读取 frame_recorder 录制的环形文件，帧左上角即录制时的检测区域左上角"""
+        from frame_recorder import FrameRecording
+        recording = FrameRecording(path)
+        return cls(recording, recording.timestamps, recording.region[:2], loop, path)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def finished(self):
+        return not self.loop and self.index >= len(self.frames) - 1
+
+    def begin_frame(self):
+        if self.finished:
+            raise ReplayFinished("回放已结束")
+        self.index += 1
+        if self.loop:
+            self.index %= len(self.frames)
+        if self.timestamps is None:
+            return float(self.index)
+        return float(self.timestamps[self.index])
+
+    def grab(self, rect):
+        x, y = rect["left"] - self.origin[0], rect["top"] - self.origin[1]
+        return self.frames[self.index][y:y + rect["height"], x:x + rect["width"]]
+
+
+CAPTURE_SOURCES = ("mss", "synthetic", "replay")
+
+
+def create_capture_source(kind="mss", **options):
+    """按名称创建截图来源，options 与各来源的构造参数对应（synthetic 的 template 为图片路径）"""
+    if kind not in CAPTURE_SOURCES:
+        raise ValueError(f"未知的截图来源: {kind}")
+    if kind == "mss":
+        return MssCaptureSource()
+    if kind == "synthetic":
+        template = cv2.imread(options.pop("template"), cv2.IMREAD_GRAYSCALE)
+        if template is None:
+            raise ValueError("合成画面的模板图片加载失败")
+        return SyntheticCaptureSource(options.pop("width"), options.pop("height"), template, **options)
+    path = options.pop("path")
+    if os.path.isfile(path):
+        return ReplayCaptureSource.from_recording(path, **options)
+    return ReplayCaptureSource.from_directory(path, **options)
@@ -0,0 +1,420 @@
+import bisect
+import heapq
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from metrics import DISABLED
+from poll_governor import SpinGovernor
+
+# 最后阶段自旋等待的时长：Windows 上 Event.wait 的精度较差，需要更长的自旋
+DEFAULT_SPIN = 0.016 if sys.platform == "win32" else 0.002
+
+
+def sleep_until(deadline, clock=time.monotonic, wake_event=None, spin=DEFAULT_SPIN):
+    """先粗睡到 deadline - spin，再自旋到 deadline；wake_event 被置位时提前返回 False"""
+    if getattr(clock, "virtual", False):
+        # 虚拟时钟没有真实等待，直接跳到截止时间
+        if wake_event is not None and wake_event.is_set():
+            return False
+        clock.advance_to(deadline)
+        return True
+    while True:
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return True
+        if remaining > spin:
+            if wake_event is not None:
+                if wake_event.wait(remaining - spin):
+                    return False
+            else:
+                time.sleep(remaining - spin)
+        else:
+            while clock() < deadline:
+                pass
+            return True
+
+
+# 编译后的时间节点：创建后不可修改，保存每个节点相对起点的累计偏移，
+# 第 k 个截止时间 O(1) 算出，按时刻查找下一个截止时间 O(log n)；可在线程间直接共享
+class CompiledSchedule:
+    __slots__ = ("intervals", "offsets", "period")
+
+    def __init__(self, intervals):
+        intervals = tuple(intervals)
+        if not intervals:
+            raise ValueError("没有设置时间节点")
+        if any(not v > 0 for v in intervals):
+            raise ValueError(f"时间间隔必须大于0: {list(intervals)}")
+        offsets = []
+        total = 0
+        for interval in intervals:
+            total += interval
+            offsets.append(total)
+        object.__setattr__(self, "intervals", intervals)
+        object.__setattr__(self, "offsets", tuple(offsets))
+        object.__setattr__(self, "period", total)  # 一轮的总时长
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledSchedule 不可修改")
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __str__(self):
+        return str(list(self.intervals))
+
+    def deadline(self, origin, k):
+        """以 origin 为起点的第 k 个截止时间（k 从 0 开始），不累加浮点误差"""
+        cycle, i = divmod(k, len(self.intervals))
+        return origin + cycle * self.period + self.offsets[i]
+
+    def index_after(self, origin, t):
+        """返回第一个晚于 t 的截止时间的序号"""
+        elapsed = t - origin
+        if elapsed < self.offsets[0]:
+            return 0
+        cycle = int(elapsed // self.period)
+        k = cycle * len(self.intervals) + bisect.bisect_right(self.offsets, elapsed - cycle * self.period)
+        # 取整和减法的舍入误差最多差一个节点
+        while self.deadline(origin, k) <= t:
+            k += 1
+        return k
+
+    def interval(self, k):
+        """第 k 个截止时间之前的间隔"""
+        return self.intervals[k % len(self.intervals)]
+
+
+def compile_schedule(interval_pattern):
+    """已编译的直接返回，否则复制并编译；时间节点为空或不为正时抛出 ValueError"""
+    if isinstance(interval_pattern, CompiledSchedule):
+        return interval_pattern
+    return CompiledSchedule(interval_pattern)
+
+
+# 基于单调时钟的截止时间调度：截止时间 = 起点 + 累计偏移，不随执行延迟漂移；
+# 时间节点为不可变的 CompiledSchedule，替换时整体换掉引用
+class DeadlineScheduler:
+    def __init__(self, interval_pattern, clock=time.monotonic, lateness_history=1000):
+        self.schedule = compile_schedule(interval_pattern)
+        self.clock = clock
+        self.start_time = 0
+        self.origin = 0  # 当前时间节点序列的起点，重置时改变
+        self.count = 0  # 下一个截止时间在当前序列中的序号
+        self.next_deadline = 0
+        self.skipped = 0  # 因严重落后而跳过的截止时间数
+        self.lateness = deque(maxlen=lateness_history)  # 每次点击的迟到秒数
+
+    @property
+    def interval_pattern(self):
+        return list(self.schedule.intervals)
+
+    def start(self, now=None):
+        self.start_time = self.clock() if now is None else now
+        self.origin = self.start_time
+        self.count = 0
+        self.next_deadline = self.schedule.deadline(self.origin, 0)
+        self.skipped = 0
+        self.lateness.clear()
+
+    def swap(self, interval_pattern, now=None, keep_phase=False):
+        """换成新的时间节点。keep_phase 为 False 时以 now 为起点重新开始；
+        为 True 时保持原起点，从新序列中 now 之后的第一个节点继续"""
+        schedule = compile_schedule(interval_pattern)
+        now = self.clock() if now is None else now
+        if keep_phase:
+            self.count = schedule.index_after(self.origin, now)
+        else:
+            self.origin = now
+            self.count = 0
+        self.schedule = schedule
+        self.next_deadline = schedule.deadline(self.origin, self.count)
+
+    def reset(self, interval_pattern, now=None):
+        """以 now 为起点重新开始新的时间节点序列"""
+        self.swap(interval_pattern, now)
+
+    def due(self, now):
+        return now >= self.next_deadline
+
+    def complete(self, actual_time):
+        """记录本次点击的迟到量并推进到下一个截止时间"""
+        self.lateness.append(actual_time - self.next_deadline)
+        self.count += 1
+        self.next_deadline = self.schedule.deadline(self.origin, self.count)
+        if self.next_deadline <= actual_time:
+            # 系统休眠等导致严重落后时直接定位到之后的节点，而不是连续补点
+            count = self.schedule.index_after(self.origin, actual_time)
+            self.skipped += count - self.count
+            self.count = count
+            self.next_deadline = self.schedule.deadline(self.origin, count)
+
+    @property
+    def current_interval(self):
+        return self.schedule.interval(self.count)
+
+    def lateness_stats(self):
+        if not self.lateness:
+            return {"count": 0, "mean": 0.0, "max": 0.0}
+        return {
+            "count": len(self.lateness),
+            "mean": sum(self.lateness) / len(self.lateness),
+            "max": max(self.lateness),
+        }
+
+
+# 多目标调度中的一个点击目标，每个目标有自己的时间节点、相位偏移和启用状态
+class ClickTarget:
+    def __init__(self, target_id, click_pos, interval_pattern, phase=0.0, enabled=True, clock=time.monotonic):
+        self.target_id = target_id
+        self.click_pos = click_pos
+        self.phase = phase
+        self.enabled = enabled
+        self.scheduler = DeadlineScheduler(interval_pattern, clock)
+        self.generation = 0  # 每次重新排程加一，堆中旧条目据此作废
+        self.click_counter = 0
+
+
+# 单线程定时堆：所有目标的下一个截止时间放在一个最小堆里，重新排程 O(log n)
+class TimerHeap:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []  # (截止时间, 序号, 目标id, generation)
+        self.targets = {}
+        self._seq = 0
+
+    def _push(self, target):
+        target.generation += 1
+        self._seq += 1
+        heapq.heappush(self.heap, (target.scheduler.next_deadline, self._seq, target.target_id, target.generation))
+
+    def add(self, target, now=None):
+        now = self.clock() if now is None else now
+        self.remove(target.target_id)
+        self.targets[target.target_id] = target
+        target.scheduler.start(now + target.phase)
+        if target.enabled:
+            self._push(target)
+
+    def remove(self, target_id):
+        target = self.targets.pop(target_id, None)
+        if target is not None:
+            target.generation += 1  # 堆中的条目在弹出时被丢弃
+        return target
+
+    def set_enabled(self, target_id, enabled, now=None):
+        target = self.targets.get(target_id)
+        if target is None or target.enabled == enabled:
+            return
+        target.enabled = enabled
+        if enabled:
+            # 重新启用时从当前时刻按相位重新开始
+            target.scheduler.start((self.clock() if now is None else now) + target.phase)
+            self._push(target)
+        else:
+            target.generation += 1
+
+    def reschedule(self, target_id, interval_pattern, now=None, keep_phase=False):
+        target = self.targets.get(target_id)
+        if target is None:
+            return
+        target.scheduler.swap(interval_pattern, self.clock() if now is None else now, keep_phase)
+        if target.enabled:
+            self._push(target)
+
+    def _discard_stale(self):
+        heap = self.heap
+        while heap:
+            _, _, target_id, generation = heap[0]
+            target = self.targets.get(target_id)
+            if target is not None and target.generation == generation:
+                return
+            heapq.heappop(heap)
+
+    def next_deadline(self):
+        self._discard_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """弹出一个已到期的目标，没有到期目标时返回 None；调用方点击后需调用 complete"""
+        self._discard_stale()
+        if not self.heap or self.heap[0][0] > now:
+            return None
+        _, _, target_id, _ = heapq.heappop(self.heap)
+        return self.targets[target_id]
+
+    def complete(self, target, actual_time):
+        target.click_counter += 1
+        target.scheduler.complete(actual_time)
+        if target.enabled and target.target_id in self.targets:
+            self._push(target)
+
+
+# 不依赖 Qt 的多目标点击循环：界面的 PrecisionClickEngine 在线程中调用 run，
+# headless.py 同样在线程中运行，simulation.py 用 begin / service 按虚拟时钟逐步驱动
+class MultiTargetRunner:
+    def __init__(self, click_fn, targets=(), telemetry=None, on_error=None, metrics=None, clock=time.monotonic,
+                 journal=None, on_trigger=None):
+        """on_error 为回调 (目标id, 消息)；on_trigger 为回调 (目标id, 检测时刻, 点击时刻, 新时间节点)，
+        在检测触发的点击完成后调用。两者都在运行线程中调用"""
+        self.click_fn = click_fn
+        self.timers = TimerHeap(clock)
+        self.pending_targets = list(targets)
+        self.commands = queue.SimpleQueue()  # 其他线程的修改请求，统一在运行线程中执行
+        self.telemetry = telemetry
+        self.on_error = on_error
+        self.wake_event = threading.Event()
+        self.reaction_latency = deque(maxlen=1000)  # 检测到匹配 -> 完成点击 的延迟（秒）
+        self.metrics = metrics if metrics is not None else DISABLED
+        self.timer = self.metrics.timer("click.")
+        self.spin = SpinGovernor(DEFAULT_SPIN)  # 按实测迟到和 CPU 占用调整截止时间前的自旋时长
+        self.journal = journal  # EventJournal，记录每次点击的计划和实际时刻
+        self.on_trigger = on_trigger
+        self.running = False
+        self.start_timestamp = 0
+
+    def run(self):
+        self.begin()
+        while self.running:
+            if self.service():
+                continue
+            deadline = self.timers.next_deadline()
+            if deadline is not None:
+                sleep_until(deadline, self.timers.clock, self.wake_event, self.spin.spin)
+            else:
+                self.wake_event.wait()
+            self.wake_event.clear()
+
+    def begin(self):
+        self.running = True
+        self.wake_event.clear()
+        self.start_timestamp = self.timers.clock()
+        if self.telemetry is not None:
+            self.telemetry.set("clicks.start_time", self.start_timestamp)
+        for target in self.pending_targets:
+            self.timers.add(target, self.start_timestamp)
+            self.publish(target)
+        self.pending_targets = []
+
+    def service(self):
+        """执行待处理的命令和一个已到期的点击，有点击时返回 True；模拟器直接调用而不经过 run 的等待"""
+        self.process_commands()
+        target = self.timers.pop_due(self.timers.clock())
+        if target is None:
+            return False
+        deadline = target.scheduler.next_deadline
+        self.timer.start()
+        self.click(target)
+        self.timer.lap("dispatch")
+        clicked_at = self.timers.clock()
+        self.timers.complete(target, clicked_at)
+        if self.journal is not None:
+            self.journal.record_click(target.target_id, deadline, clicked_at)
+        self.metrics.record("click.lateness", target.scheduler.lateness[-1])
+        self.spin.update(target.scheduler.lateness[-1], clicked_at)
+        self.publish(target)
+        return True
+
+    def click(self, target):
+        try:
+            self.click_fn(*target.click_pos)
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(str(target.target_id), f"点击失败: {str(e)}")
+
+    def publish(self, target):
+        if self.telemetry is None:
+            return
+        key = ("click", target.target_id)
+        self.telemetry.set(key + ("count",), target.click_counter)
+        self.telemetry.set(key + ("enabled",), target.enabled and target.target_id in self.timers.targets)
+        self.telemetry.set(key + ("next_deadline",), target.scheduler.next_deadline)
+
+    def process_commands(self):
+        while True:
+            try:
+                command, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if command == "add":
+                self.timers.add(args[0])
+                self.publish(args[0])
+                continue
+            if command == "trigger":
+                self.handle_trigger(*args)
+                continue
+            if command == "click_at":
+                self.handle_click_at(*args)
+                continue
+            getattr(self.timers, command)(*args)
+            target = self.timers.targets.get(args[0])
+            if target is not None:
+                self.publish(target)
+            elif command == "remove" and self.telemetry is not None:
+                self.telemetry.set(("click", args[0], "enabled"), False)
+
+    def handle_trigger(self, target_id, detected_at, interval_pattern):
+        # 立即点击一次；给定时间节点时以点击时刻为起点重置该目标
+        target = self.timers.targets.get(target_id)
+        if target is None or not target.enabled:
+            return  # 已暂停的目标不响应检测触发
+        self.click(target)
+        clicked_at = self.timers.clock()
+        target.click_counter += 1
+        if self.journal is not None:
+            self.journal.record_click(target_id, None, clicked_at)
+        if detected_at is not None:
+            self.reaction_latency.append(clicked_at - detected_at)
+            self.metrics.record("click.reaction", clicked_at - detected_at)
+        if interval_pattern:
+            self.timers.reschedule(target_id, interval_pattern, clicked_at)
+        self.publish(target)
+        if self.on_trigger is not None:
+            self.on_trigger(target_id, detected_at, clicked_at, interval_pattern)
+
+    def handle_click_at(self, pos, detected_at):
+        # 点击任意坐标一次（规则动作），不影响各目标的时间节点
+        try:
+            self.click_fn(*pos)
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error("", f"点击失败: {str(e)}")
+            return
+        clicked_at = self.timers.clock()
+        if self.journal is not None:
+            self.journal.record_click(pos, None, clicked_at)
+        if detected_at is not None:
+            self.reaction_latency.append(clicked_at - detected_at)
+            self.metrics.record("click.reaction", clicked_at - detected_at)
+
+    def post(self, command, *args):
+        """线程安全：可在任意线程调用，命令由运行线程执行"""
+        self.commands.put((command, args))
+        self.wake_event.set()
+
+    def add_target(self, target):
+        self.post("add", target)
+
+    def remove_target(self, target_id):
+        self.post("remove", target_id)
+
+    def set_enabled(self, target_id, enabled):
+        self.post("set_enabled", target_id, enabled)
+
+    def reschedule(self, target_id, interval_pattern, keep_phase=False):
+        """在调用线程中编译时间节点（无效时在此抛出 ValueError），运行线程只替换引用"""
+        self.post("reschedule", target_id, compile_schedule(interval_pattern), None, keep_phase)
+
+    def click_at(self, pos, detected_at=None):
+        self.post("click_at", tuple(pos), detected_at)
+
+    def trigger(self, target_id, detected_at=None, interval_pattern=None):
+        schedule = compile_schedule(interval_pattern) if interval_pattern else None
+        self.post("trigger", target_id, detected_at, schedule)
+
+    def stop(self):
+        self.running = False
+        self.wake_event.set()
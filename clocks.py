@@ -0,0 +1,45 @@
+import time
+
+
+# 系统时钟：调用返回单调时钟读数，可直接作为各调度器的 clock 参数
+class SystemClock:
+    virtual = False
+
+    def __call__(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """等待事件或超时，事件被置位时返回 True"""
+        return event.wait(timeout)
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+# 虚拟时钟：时间只在显式推进或 sleep 时前进，用于在几秒内模拟数天的调度
+class VirtualClock:
+    virtual = True
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance_to(self, t):
+        if t > self.now:
+            self.now = t
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        self.sleep(timeout or 0)
+        return False
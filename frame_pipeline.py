@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+
+# 按区域复用的缓冲池：同一个 key 的缓冲只在尺寸变化时重新分配
+class BufferPool:
+    def __init__(self):
+        self.buffers = {}
+        self.allocated_bytes = 0  # 累计分配的字节数
+
+    def acquire(self, key, shape, dtype=np.uint8):
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+            self.allocated_bytes += buf.nbytes
+        return buf
+
+    def release(self, key):
+        self.buffers.pop(key, None)
+
+    def clear(self):
+        self.buffers.clear()
+
+
+def bgra_view(shot):
+    """把 mss 截图的原始缓冲包装成 (h, w, 4) 视图，不拷贝数据"""
+    width, height = shot.width, shot.height
+    raw = shot.raw
+    if len(raw) == width * height * 4:
+        return np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+    # 部分平台每行带有填充字节，只能按行步长取视图
+    stride = len(raw) // height
+    view = np.frombuffer(raw, dtype=np.uint8).reshape(height, stride)[:, :width * 4]
+    return view.reshape(height, width, 4)
+
+
+# 截图 -> 灰度图的帧处理流水线，所有中间结果都写入预分配缓冲
+class FramePipeline:
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else BufferPool()
+        self.last_copy_bytes = 0  # 最近一帧拷贝的字节数
+        self.total_copy_bytes = 0
+        self.frames = 0
+
+    def to_gray(self, frame, key=None, out=None):
+        """把 BGRA/BGR/灰度帧转换到该区域的持久灰度缓冲中，给定 out 时直接写入 out"""
+        copied = 0
+        if frame.ndim == 2:
+            gray = frame
+            if out is not None:
+                # 灰度来源（合成画面、回放）也要写入调用方给的缓冲，例如共享内存槽
+                np.copyto(out, frame)
+                copied += frame.nbytes
+                gray = out
+        else:
+            if frame.strides[2] != 1 or frame.strides[1] != frame.shape[2]:
+                # cvtColor 需要像素连续，极少数情况下退化为一次拷贝
+                frame = np.ascontiguousarray(frame)
+                copied += frame.nbytes
+            gray = out if out is not None else self.pool.acquire(("gray", key), frame.shape[:2])
+            code = cv2.COLOR_BGRA2GRAY if frame.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+            cv2.cvtColor(frame, code, dst=gray)
+        self._account(copied)
+        return gray
+
+    def process(self, shot, key=None):
+        """处理一帧 mss 截图，返回复用的灰度缓冲（下一帧会被覆盖）"""
+        return self.to_gray(bgra_view(shot), key)
+
+    def _account(self, copied):
+        self.frames += 1
+        self.last_copy_bytes = copied
+        self.total_copy_bytes += copied
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "last_copy_bytes": self.last_copy_bytes,
+            "avg_copy_bytes": self.total_copy_bytes / self.frames if self.frames else 0.0,
+            "allocated_bytes": self.pool.allocated_bytes,
+        }
@@ -0,0 +1,171 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# 录制文件布局：固定头 + 时间戳环 + 帧环，整个文件通过 np.memmap 映射，磁盘占用固定
+RECORDING_MAGIC = b"APREC001"
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("height", "<u4"),
+    ("width", "<u4"),
+    ("capacity", "<u4"),
+    ("reserved", "<u4"),
+    ("region", "<i4", (4,)),
+    ("write_count", "<u8"),  # 累计写入的帧数，最后更新，读取方据此判断哪些帧有效
+])
+HEADER_SIZE = 64
+
+
+def _layout(height, width, capacity):
+    ts_offset = HEADER_SIZE
+    frame_offset = ts_offset + capacity * 8
+    return ts_offset, frame_offset, frame_offset + capacity * height * width
+
+
+# 帧录制器：把检测区域的灰度帧和时间戳追加到内存映射的环形文件，写满后覆盖最旧的帧
+class FrameRecorder:
+    def __init__(self, path, shape, capacity=3000, region=(0, 0, 0, 0)):
+        height, width = shape[:2]
+        ts_offset, frame_offset, size = _layout(height, width, capacity)
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self.path = path
+        self.capacity = capacity
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", offset=0, shape=(1,))
+        self.header["magic"] = RECORDING_MAGIC
+        self.header["height"], self.header["width"], self.header["capacity"] = height, width, capacity
+        self.header["region"] = region
+        self.header["write_count"] = 0
+        self.timestamps = np.memmap(path, dtype="<f8", mode="r+", offset=ts_offset, shape=(capacity,))
+        self.frames = np.memmap(path, dtype=np.uint8, mode="r+", offset=frame_offset,
+                                shape=(capacity, height, width))
+        self.write_count = 0
+
+    def append(self, gray, timestamp):
+        slot = self.write_count % self.capacity
+        np.copyto(self.frames[slot], gray)
+        self.timestamps[slot] = timestamp
+        self.write_count += 1
+        self.header["write_count"] = self.write_count
+
+    def flush(self):
+        self.frames.flush()
+        self.timestamps.flush()
+        self.header.flush()
+
+    def close(self):
+        self.flush()
+        del self.frames, self.timestamps, self.header
+
+
+# 只读打开录制文件，按时间顺序访问帧（支持下标和 len，可直接交给 ReplayCaptureSource）
+class FrameRecording:
+    def __init__(self, path):
+        header = np.memmap(path, dtype=HEADER_DTYPE, mode="r", offset=0, shape=(1,))[0]
+        if header["magic"] != RECORDING_MAGIC:
+            raise ValueError(f"不是有效的录制文件: {path}")
+        height, width, capacity = int(header["height"]), int(header["width"]), int(header["capacity"])
+        ts_offset, frame_offset, _ = _layout(height, width, capacity)
+        write_count = int(header["write_count"])
+        self.region = tuple(int(v) for v in header["region"])
+        self.count = min(write_count, capacity)
+        self.start = write_count % capacity if write_count > capacity else 0  # 最旧一帧所在的槽
+        self.capacity = capacity
+        self._timestamps = np.memmap(path, dtype="<f8", mode="r", offset=ts_offset, shape=(capacity,))
+        self._frames = np.memmap(path, dtype=np.uint8, mode="r", offset=frame_offset,
+                                 shape=(capacity, height, width))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self._frames[(self.start + index) % self.capacity]
+
+    @property
+    def timestamps(self):
+        return np.roll(np.asarray(self._timestamps[:self.count]), -self.start)
+
+
+def replay_recording(path, template_gray, threshold=0.9, match_mode="auto", change_gate=True, track_roi=True,
+                     hold_seconds=5, realtime=False, prefilter=None, stats=None):
+    """用 TemplateMatcherThread 相同的判定逻辑回放录制文件，返回每帧的
+    (时间戳, 得分, 位置, 是否匹配, 是否持续匹配)；结果只取决于录制内容和参数。
+    给定 stats 字典时写入预筛选各阶段的排除计数"""
+    from matching import MatchEvaluator, PrefilterCascade, create_matcher, find_matcher
+
+    recording = FrameRecording(path)
+    matcher = create_matcher(template_gray, match_mode, recording.region, change_gate=change_gate,
+                             track_threshold=threshold if track_roi else None, prefilter=prefilter,
+                             prefilter_threshold=threshold)
+    evaluator = MatchEvaluator(matcher, threshold, hold_seconds)
+    timestamps = recording.timestamps
+    results = []
+    wall_start = time.monotonic()
+    for i in range(len(recording)):
+        if realtime:
+            # 按录制时的时间间隔回放
+            delay = (timestamps[i] - timestamps[0]) - (time.monotonic() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        score, loc, matched, persistent = evaluator.evaluate(recording[i], float(timestamps[i]))
+        results.append((float(timestamps[i]), score, loc, matched, persistent))
+    cascade = find_matcher(matcher, PrefilterCascade)
+    if stats is not None and cascade is not None:
+        stats.update(cascade.stats())
+    return results
+
+
+def main(argv=None):
+    import cv2
+
+    parser = argparse.ArgumentParser(description="离线回放检测录制文件")
+    parser.add_argument("recording", help="录制文件路径")
+    parser.add_argument("--template", default="test.png", help="模板图片路径")
+    parser.add_argument("--thresholds", default="0.9", help="逗号分隔的匹配阈值，逐个回放比较")
+    parser.add_argument("--mode", default="auto", help="匹配模式: auto / full / pyramid / fft")
+    parser.add_argument("--hold-seconds", type=float, default=5, help="持续匹配的判定时长（秒）")
+    parser.add_argument("--realtime", action="store_true", help="按录制时的时间间隔回放")
+    parser.add_argument("--prefilter", help="逗号分隔的预筛选阶段: histogram / variance / coarse")
+    parser.add_argument("--csv", help="把最后一个阈值的逐帧结果写入 CSV")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.recording):
+        print(f"错误: 找不到录制文件 {args.recording}", file=sys.stderr)
+        return 2
+    template = cv2.imread(args.template, cv2.IMREAD_GRAYSCALE)
+    if template is None:
+        print(f"错误: 模板图片加载失败 {args.template}", file=sys.stderr)
+        return 2
+
+    results = []
+    for threshold in (float(v) for v in args.thresholds.split(",")):
+        started = time.perf_counter()
+        stats = {}
+        results = replay_recording(args.recording, template, threshold, args.mode,
+                                   hold_seconds=args.hold_seconds, realtime=args.realtime,
+                                   prefilter=args.prefilter.split(",") if args.prefilter else None, stats=stats)
+        elapsed = time.perf_counter() - started
+        matched = sum(1 for r in results if r[3])
+        persistent = sum(1 for r in results if r[4])
+        print(f"阈值 {threshold:.3f}: {len(results)} 帧, 匹配 {matched} 帧, 持续匹配触发 {persistent} 次, "
+              f"最高得分 {max((r[1] for r in results), default=0):.4f}, 用时 {elapsed:.2f}s")
+        if stats:
+            rejected = ", ".join(f"{name} {count}" for name, count in stats["rejected"].items())
+            print(f"    预筛选: {stats['frames']} 帧中 {stats['passed']} 帧进入完整匹配, 排除: {rejected}")
+
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8") as f:
+            f.write("timestamp,score,x,y,matched,persistent\n")
+            for ts, score, loc, matched, persistent in results:
+                x, y = loc if loc is not None else ("", "")
+                f.write(f"{ts:.6f},{score:.6f},{x},{y},{int(matched)},{int(persistent)}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import time
+
+_STARTED_AT = time.perf_counter()  # 尽早记录，用于统计冷启动耗时
+
+import argparse
+import json
+import sys
+import threading
+
+# 无界面运行器：按配置文件运行点击和检测引擎，不加载 Qt。
+# 重量级依赖（cv2 / numpy / mss）只有在配置了检测项时才会导入。
+#
+# 配置示例:
+# {
+#     "clicks": [{"id": "main", "pos": [800, 600], "intervals": [9, 10], "phase": 0}],
+#     "watches": [{"name": "btn", "template": "test.png", "region": [0, 0, 800, 600],
+#                  "threshold": 0.9, "hold_seconds": 5, "mode": "auto",
+#                  "prefilter": ["histogram", "variance", "coarse"], "workers": 4, "cpu_budget": 0.5,
+#                  "on_persistent": {"click": "main", "reset": [9, 10]}}],
+#     "poll_interval": 0.1,
+#     "poll_cpu_budget": 0.25,
+#     "capture": {"type": "mss"},
+#     "input_backend": "auto",
+#     "duration": null,
+#     "template_cache": null,
+#     "metrics": {"path": "metrics.json", "port": null},
+#     "journal": {"path": "journal"},
+#     "schedules": {"normal": [9, 10]},
+#     "rules": [{"when": {"absent": "btn", "for": 30}, "do": [{"pause": "main"}]}]
+# }
+# poll_cpu_budget 为检测线程自身最多占用单个核心的比例，超出时自适应轮询拉长间隔（0 表示不限制）；
+# 检测项中的 cpu_budget 只限制分块并行匹配的线程数，两者互不影响。
+# rules / schedules 的完整写法见 rules.py
+
+HEAVY_MODULES = ("PyQt5", "cv2", "numpy", "mss")
+
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.setdefault("clicks", [])
+    config.setdefault("watches", [])
+    if not config["clicks"] and not config["watches"]:
+        raise ValueError("配置中没有任何点击目标或检测项")
+    return config
+
+
+def build_click_runner(config, metrics=None, clock=None, backend=None, journal=None):
+    """clock / backend 用于注入虚拟时钟和记录后端（见 simulation.py）"""
+    from click_scheduler import ClickTarget, MultiTargetRunner
+    from clocks import SYSTEM_CLOCK
+    from input_backend import create_input_backend
+
+    clock = clock if clock is not None else SYSTEM_CLOCK
+    targets = []
+    for item in config["clicks"]:
+        if not item.get("intervals"):
+            raise ValueError(f"点击目标 {item.get('id')} 没有设置时间节点")
+        targets.append(ClickTarget(item["id"], tuple(item["pos"]), item["intervals"],
+                                   phase=item.get("phase", 0.0), enabled=item.get("enabled", True), clock=clock))
+    if backend is None:
+        backend = create_input_backend(config.get("input_backend", "auto"))
+    runner = MultiTargetRunner(backend.click, targets,
+                               on_error=lambda target_id, message: print(f"[{target_id}] {message}", file=sys.stderr),
+                               metrics=metrics, clock=clock, journal=journal)
+    runner.input_backend = backend
+    return runner
+
+
+def build_match_runner(config, click_runner, metrics=None, journal=None, watches=None, capture_factory=None,
+                       clock=None):
+    """watches / capture_factory / clock 用于注入现成的监视项、截图来源和虚拟时钟（见 simulation.py），
+    不给出时按配置加载模板并创建截图来源"""
+    from capture import create_capture_source
+    from click_scheduler import compile_schedule
+    from multi_matcher import MatchWatch, MultiMatchRunner
+    from rules import build_rules
+    from template_store import TemplateStore, get_default_store
+
+    if watches is None:
+        # 模板通过缓存加载，模板库很大时启动也只需映射已处理好的数据
+        store = TemplateStore(config["template_cache"]) if config.get("template_cache") else get_default_store()
+        watches = []
+        for item in config["watches"]:
+            entry = store.load(item["template"])
+            watches.append(MatchWatch(item["name"], entry.gray, item["region"], item.get("threshold", 0.9),
+                                      item.get("hold_seconds", 5), item.get("mode", "auto"),
+                                      template_entry=entry, prefilter=item.get("prefilter"),
+                                      workers=item.get("workers", 1), cpu_budget=item.get("cpu_budget", 0.5)))
+    reactions = {}
+    target_ids = {item["id"] for item in config["clicks"]}
+    for item in config["watches"]:
+        if item.get("on_persistent"):
+            reaction = reactions[item["name"]] = dict(item["on_persistent"])
+            if "click" not in reaction:
+                raise ValueError(f"监视项 {item['name']} 的 on_persistent 没有设置 click")
+            if reaction["click"] not in target_ids:
+                raise ValueError(f"监视项 {item['name']} 的 on_persistent 指向不存在的点击目标 {reaction['click']}")
+            if reaction.get("reset"):
+                # 启动时编译一次，无效的时间节点在这里报错，触发时直接替换
+                reaction["reset"] = compile_schedule(reaction["reset"])
+
+    def on_persistent(result, detected_at):
+        reaction = reactions.get(result.name)
+        if reaction is None or click_runner is None:
+            print(f"[{result.name}] 持续匹配 score={result.score:.3f} loc={result.loc}")
+            return
+        click_runner.trigger(reaction["click"], detected_at, reaction.get("reset"))
+
+    if capture_factory is None:
+        # capture 可选 mss（实时屏幕）、synthetic（合成画面）、replay（回放录制的帧目录）
+        capture = dict(config.get("capture", {"type": "mss"}))
+        kind = capture.pop("type", "mss")
+
+        def capture_factory():
+            return create_capture_source(kind, **capture)
+    return MultiMatchRunner(watches, config.get("poll_interval", 0.1), on_persistent=on_persistent,
+                            capture_factory=capture_factory, metrics=metrics,
+                            rules=build_rules(config, click_runner), journal=journal,
+                            poll_cpu_budget=config.get("poll_cpu_budget", 0.25), clock=clock)
+
+
+def startup_report(ready_at):
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    return f"冷启动耗时 {(ready_at - _STARTED_AT) * 1000:.1f}ms，已加载: {', '.join(loaded) or '无重量级依赖'}"
+
+
+def run(config, report_startup=False, on_wait=None):
+    """on_wait 在等待期间约每 0.5 秒调用一次（例如 simulation.py 的浸泡测试采样）"""
+    from metrics import Metrics
+
+    # 配置了 metrics 时统计各阶段耗时，结束时写入 path，设置 port 时运行期间可通过本机 HTTP 查看
+    metrics_config = config.get("metrics")
+    metrics = Metrics(enabled=bool(metrics_config))
+    journal = click_runner = match_runner = None
+    runners, threads = [], []
+    # 统计端口、事件日志和运行器都在 try 内启动，任何一步失败时 finally 都会关闭已经启动的部分
+    try:
+        if metrics_config and metrics_config.get("port") is not None:
+            try:
+                port = metrics.serve(metrics_config["port"])
+                print(f"统计数据: http://127.0.0.1:{port}/")
+            except OSError as e:
+                # 端口无法监听时只是没有实时统计，点击和检测照常运行
+                print(f"实时统计端口 {metrics_config['port']} 无法监听: {str(e)}", file=sys.stderr)
+        # 配置了 journal 时把每次点击和每帧匹配得分写入 path 目录下按天划分的事件日志（见 journal.py）
+        if config.get("journal"):
+            from journal import EventJournal
+            journal = EventJournal(config["journal"]["path"])
+        # 规则可以点击任意坐标，没有点击目标时也需要点击运行器
+        click_runner = (build_click_runner(config, metrics, journal=journal)
+                        if config["clicks"] or config.get("rules") else None)
+        match_runner = build_match_runner(config, click_runner, metrics, journal) if config["watches"] else None
+        runners = [r for r in (click_runner, match_runner) if r is not None]
+        threads = [threading.Thread(target=r.run, daemon=True) for r in runners]
+        for thread in threads:
+            thread.start()
+        if report_startup:
+            print(startup_report(time.perf_counter()))
+
+        duration = config.get("duration")
+        end_time = time.monotonic() + duration if duration else None
+        # 有检测项时以检测线程为准（回放结束即退出），否则等所有引擎退出
+        waited = threads[-1:] if match_runner is not None else threads
+        while True:
+            if end_time is not None:
+                remaining = end_time - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(0.5, remaining))
+            else:
+                if not any(t.is_alive() for t in waited):
+                    break
+                time.sleep(0.5)
+            if on_wait is not None:
+                on_wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for runner in runners:
+            runner.stop()
+        for thread in threads:
+            thread.join(2.0)
+        if click_runner is not None:
+            click_runner.input_backend.close()
+        if match_runner is not None:
+            for name, stats in match_runner.prefilter_stats().items():
+                rejected = "  ".join(f"{stage} {count}" for stage, count in stats["rejected"].items())
+                print(f"[{name}] 预筛选: {stats['frames']} 帧，通过 {stats['passed']} 帧，排除: {rejected}")
+        if journal is not None:
+            journal.close()
+            stats = journal.stats()
+            if stats["dropped_clicks"] or stats["dropped_matches"] or stats["error"]:
+                print(f"事件日志丢弃了 {stats['dropped_clicks']} 次点击、{stats['dropped_matches']} 帧得分"
+                      f"{'，错误: ' + stats['error'] if stats['error'] else ''}", file=sys.stderr)
+        if metrics_config:
+            if metrics_config.get("path"):
+                metrics.dump(metrics_config["path"])
+            metrics.close()
+    return click_runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="自动识别点击器（无界面模式）")
+    parser.add_argument("config", help="JSON 配置文件路径")
+    parser.add_argument("--duration", type=float, help="运行秒数，覆盖配置中的 duration")
+    parser.add_argument("--input", choices=("auto", "windows", "xtest", "recording"),
+                        help="输入后端，覆盖配置中的 input_backend")
+    parser.add_argument("--startup-report", action="store_true", help="输出冷启动耗时和已加载的重量级模块")
+    parser.add_argument("--metrics", help="统计各阶段耗时并在结束时写入该 JSON 文件")
+    parser.add_argument("--metrics-port", type=int, help="运行期间在本机该端口提供实时统计")
+    parser.add_argument("--journal", help="把点击和匹配得分写入该目录下的事件日志")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 2
+    if args.duration is not None:
+        config["duration"] = args.duration
+    if args.input is not None:
+        config["input_backend"] = args.input
+    if args.metrics is not None or args.metrics_port is not None:
+        config["metrics"] = dict(config.get("metrics") or {})
+        if args.metrics is not None:
+            config["metrics"]["path"] = args.metrics
+        if args.metrics_port is not None:
+            config["metrics"]["port"] = args.metrics_port
+    if args.journal is not None:
+        config["journal"] = {"path": args.journal}
+
+    try:
+        click_runner = run(config, args.startup_report)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 2
+    if click_runner is not None:
+        for target in click_runner.timers.targets.values():
+            stats = target.scheduler.lateness_stats()
+            print(f"[{target.target_id}] 点击次数: {target.click_counter}  "
+                  f"平均迟到 {stats['mean'] * 1000:.3f}ms  最大迟到 {stats['max'] * 1000:.3f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import ctypes
+import ctypes.util
+import os
+import sys
+import time
+
+MOUSEEVENTF_MOVE = 0x0001
+MOUSEEVENTF_LEFTDOWN = 0x0002
+MOUSEEVENTF_LEFTUP = 0x0004
+MOUSEEVENTF_VIRTUALDESK = 0x4000
+MOUSEEVENTF_ABSOLUTE = 0x8000
+INPUT_MOUSE = 0
+
+
+# 输入后端接口：点击调度只依赖 click，不关心底层如何产生鼠标事件
+class InputBackend:
+    name = "base"
+
+    def move(self, x, y):
+        raise NotImplementedError
+
+    def click(self, x, y):
+        raise NotImplementedError
+
+    def click_many(self, points):
+        for x, y in points:
+            self.click(x, y)
+
+    def close(self):
+        pass
+
+
+# Windows：移动、按下、释放合并为一次 SendInput 调用，INPUT 数组预先分配并复用
+class WindowsInputBackend(InputBackend):
+    name = "windows"
+
+    def __init__(self):
+        from ctypes import wintypes
+
+        class MOUSEINPUT(ctypes.Structure):
+            _fields_ = [("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD),
+                        ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD),
+                        ("dwExtraInfo", ctypes.POINTER(wintypes.ULONG))]
+
+        class KEYBDINPUT(ctypes.Structure):
+            _fields_ = [("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD),
+                        ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.POINTER(wintypes.ULONG))]
+
+        class HARDWAREINPUT(ctypes.Structure):
+            _fields_ = [("uMsg", wintypes.DWORD), ("wParamL", wintypes.WORD), ("wParamH", wintypes.WORD)]
+
+        class _INPUTUNION(ctypes.Union):
+            _fields_ = [("mi", MOUSEINPUT), ("ki", KEYBDINPUT), ("hi", HARDWAREINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [("type", wintypes.DWORD), ("u", _INPUTUNION)]
+
+        self.INPUT = INPUT
+        self.user32 = ctypes.windll.user32
+        self.user32.SendInput.argtypes = (wintypes.UINT, ctypes.POINTER(INPUT), ctypes.c_int)
+        self.user32.SendInput.restype = wintypes.UINT
+        self.input_size = ctypes.sizeof(INPUT)
+        self.refresh_screen()
+        self.buffer = self._make_buffer(1)
+
+    def refresh_screen(self):
+        """读取虚拟桌面范围，显示器布局变化后需重新调用"""
+        metrics = self.user32.GetSystemMetrics
+        self.screen_x, self.screen_y = metrics(76), metrics(77)  # SM_XVIRTUALSCREEN / SM_YVIRTUALSCREEN
+        self.screen_w, self.screen_h = max(2, metrics(78)), max(2, metrics(79))
+
+    def _make_buffer(self, clicks):
+        buf = (self.INPUT * (clicks * 3))()
+        for i in range(clicks):
+            buf[i * 3].u.mi.dwFlags = MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK
+            buf[i * 3 + 1].u.mi.dwFlags = MOUSEEVENTF_LEFTDOWN
+            buf[i * 3 + 2].u.mi.dwFlags = MOUSEEVENTF_LEFTUP
+            for j in range(3):
+                buf[i * 3 + j].type = INPUT_MOUSE
+        return buf
+
+    def _fill(self, buf, index, x, y):
+        # 绝对坐标需要归一化到 0~65535 的虚拟桌面坐标
+        mi = buf[index * 3].u.mi
+        mi.dx = ((x - self.screen_x) * 65535) // (self.screen_w - 1)
+        mi.dy = ((y - self.screen_y) * 65535) // (self.screen_h - 1)
+
+    def _send(self, buf, count):
+        sent = self.user32.SendInput(count, buf, self.input_size)
+        if sent != count:
+            raise OSError(f"SendInput 只发送了 {sent}/{count} 个事件")
+
+    def move(self, x, y):
+        self._fill(self.buffer, 0, x, y)
+        self._send(self.buffer, 1)
+
+    def click(self, x, y):
+        self._fill(self.buffer, 0, x, y)
+        self._send(self.buffer, 3)
+
+    def click_many(self, points):
+        points = list(points)
+        buf = self._make_buffer(len(points))
+        for i, (x, y) in enumerate(points):
+            self._fill(buf, i, x, y)
+        self._send(buf, len(buf))
+
+
+# Linux：通过 XTest 扩展注入鼠标事件，需要 X11 显示（含 Xvfb）
+class XTestInputBackend(InputBackend):
+    name = "xtest"
+
+    def __init__(self, display_name=None):
+        xlib_path = ctypes.util.find_library("X11")
+        xtst_path = ctypes.util.find_library("Xtst")
+        if not xlib_path or not xtst_path:
+            raise RuntimeError("未找到 libX11 / libXtst")
+        self.xlib = ctypes.cdll.LoadLibrary(xlib_path)
+        self.xtst = ctypes.cdll.LoadLibrary(xtst_path)
+        self.xlib.XOpenDisplay.argtypes = (ctypes.c_char_p,)
+        self.xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self.xlib.XFlush.argtypes = (ctypes.c_void_p,)
+        self.xlib.XCloseDisplay.argtypes = (ctypes.c_void_p,)
+        self.xtst.XTestFakeMotionEvent.argtypes = (ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                                   ctypes.c_ulong)
+        self.xtst.XTestFakeButtonEvent.argtypes = (ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong)
+        self.display = self.xlib.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self.display:
+            raise RuntimeError("无法连接 X 显示，请检查 DISPLAY 环境变量")
+
+    def move(self, x, y):
+        self.xtst.XTestFakeMotionEvent(self.display, -1, x, y, 0)
+        self.xlib.XFlush(self.display)
+
+    def click(self, x, y):
+        # 三个事件先进入请求队列，最后一次 XFlush 一起发出
+        self.xtst.XTestFakeMotionEvent(self.display, -1, x, y, 0)
+        self.xtst.XTestFakeButtonEvent(self.display, 1, 1, 0)
+        self.xtst.XTestFakeButtonEvent(self.display, 1, 0, 0)
+        self.xlib.XFlush(self.display)
+
+    def click_many(self, points):
+        for x, y in points:
+            self.xtst.XTestFakeMotionEvent(self.display, -1, x, y, 0)
+            self.xtst.XTestFakeButtonEvent(self.display, 1, 1, 0)
+            self.xtst.XTestFakeButtonEvent(self.display, 1, 0, 0)
+        self.xlib.XFlush(self.display)
+
+    def close(self):
+        if self.display:
+            self.xlib.XCloseDisplay(self.display)
+            self.display = None
+
+
+# 内存记录后端：不产生真实事件，只给每个事件打上时间戳，用于测量调度精度和派发开销
+class RecordingInputBackend(InputBackend):
+    name = "recording"
+
+    def __init__(self, clock=time.perf_counter, max_events=100000):
+        self.clock = clock
+        self.max_events = max_events
+        self.events = []  # (时间戳, 事件类型, x, y)
+        self.dropped = 0
+
+    def _record(self, kind, x, y):
+        if len(self.events) < self.max_events:
+            self.events.append((self.clock(), kind, x, y))
+        else:
+            self.dropped += 1
+
+    def move(self, x, y):
+        self._record("move", x, y)
+
+    def click(self, x, y):
+        self._record("move", x, y)
+        self._record("down", x, y)
+        self._record("up", x, y)
+
+    def clicks(self):
+        """返回每次点击（按下事件）的 (时间戳, x, y)"""
+        return [(t, x, y) for t, kind, x, y in self.events if kind == "down"]
+
+    def clear(self):
+        self.events = []
+        self.dropped = 0
+
+
+INPUT_BACKENDS = ("auto", "windows", "xtest", "recording")
+
+
+def create_input_backend(name="auto"):
+    if name not in INPUT_BACKENDS:
+        raise ValueError(f"未知的输入后端: {name}")
+    if name == "auto":
+        if sys.platform == "win32":
+            name = "windows"
+        elif os.environ.get("DISPLAY"):
+            name = "xtest"
+        else:
+            raise RuntimeError("当前环境没有可用的输入后端（无 X 显示），可使用 recording 后端")
+    if name == "windows":
+        return WindowsInputBackend()
+    if name == "xtest":
+        return XTestInputBackend()
+    return RecordingInputBackend()
+
+
+_default_backend = None
+
+
+def set_default_backend(backend):
+    global _default_backend
+    _default_backend = backend
+
+
+def get_default_backend():
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = create_input_backend()
+    return _default_backend
+
+
+# 高性能点击函数
+def precise_click(x, y):
+    get_default_backend().click(x, y)
@@ -0,0 +1,356 @@
+import argparse
+import glob
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# 事件日志：记录每次点击（目标、计划时刻、实际时刻）和每次匹配得分（区域、模板、得分、位置），
+# 按列写入紧凑的二进制文件，每个进程每天一个文件 <目录>/<YYYY-MM-DD>-<进程号>.journal，
+# 多个进程写同一个目录时不会交错写入同一个文件，读取某一天时合并当天的全部文件。
+#
+# 文件由块组成，每块为 12 字节块头 (b"APJ1", 类型, 行数或字节数) + 数据：
+#   RUN      一次运行开始，之后的名称编号重新计算
+#   NAMES    JSON {编号: 名称}，编号在本次运行内有效
+#   CLICKS   按列连续存放 CLICK_COLUMNS 的各列
+#   MATCHES  按列连续存放 MATCH_COLUMNS 的各列
+# 时间均为墙上时钟秒数（单调时钟时间戳加上启动时的偏移），计划时刻为 NaN 表示检测触发的立即点击。
+#
+#   python journal.py summary journal --day 2026-01-01
+
+MAGIC = b"APJ1"
+HEADER = struct.Struct("<4sB3xI")
+RUN, NAMES, CLICKS, MATCHES = 0, 1, 2, 3
+CLICK_COLUMNS = (("target", "<u2"), ("scheduled", "<f8"), ("actual", "<f8"))
+MATCH_COLUMNS = (("time", "<f8"), ("region", "<u2"), ("template", "<u2"), ("score", "<f4"),
+                 ("x", "<i4"), ("y", "<i4"))
+CODE_COLUMNS = ("target", "region", "template")  # 保存名称编号的列，读取时换算成统一编号
+
+
+# 单个写入线程使用的缓冲通道：固定大小的列数组轮换使用，写满后整块交给后台线程
+class _Channel:
+    def __init__(self, kind, columns, block_rows, max_blocks):
+        self.kind = kind
+        self.columns = columns
+        self.rows = block_rows
+        self.free = deque(self._allocate() for _ in range(max_blocks - 1))  # 后台写完后放回
+        self.active = self._allocate()
+        self.count = 0
+        self.opened = time.monotonic()
+        self.dropped = 0  # 磁盘跟不上、缓冲用尽时丢弃的事件数
+
+    def _allocate(self):
+        return [np.empty(self.rows, dtype) for _, dtype in self.columns]
+
+
+# 事件日志写入器：记录方法只写预先分配的数组，不在热路径上做 I/O 或分配数组；
+# 每类事件只应由一个线程写入（点击线程写点击，检测线程写匹配），内存占用固定
+class EventJournal:
+    def __init__(self, root, block_rows=4096, max_blocks=8, flush_interval=5.0, clock_offset=None):
+        """max_blocks 为每类事件最多占用的缓冲块数，flush_interval 秒内未写满的块也会写出"""
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.flush_interval = flush_interval
+        # 单调时钟 -> 墙上时钟的偏移，只在启动时取一次
+        self.offset = time.time() - time.monotonic() if clock_offset is None else clock_offset
+        self.clicks = _Channel(CLICKS, CLICK_COLUMNS, block_rows, max_blocks)
+        self.matches = _Channel(MATCHES, MATCH_COLUMNS, block_rows, max_blocks)
+        self.codes = {}  # 名称 -> 编号
+        self.names = []
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()  # 交给后台线程的块和新名称，按顺序写出
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(str(name))
+                    self.codes[name] = code
+                    # 名称先于使用它的数据块入队
+                    self.queue.put((NAMES, {code: str(name)}, 0))
+        return code
+
+    def record_click(self, target, scheduled, actual):
+        """scheduled 为 None 表示立即点击；时间为单调时钟秒数"""
+        channel = self.clicks
+        if channel.count == channel.rows and not self._rotate(channel):
+            channel.dropped += 1
+            return
+        i = channel.count
+        targets, scheduled_col, actual_col = channel.active
+        targets[i] = self.code(target)
+        scheduled_col[i] = np.nan if scheduled is None else scheduled + self.offset
+        actual_col[i] = actual + self.offset
+        self._advance(channel)
+
+    def record_match(self, now, region, template, score, loc):
+        """region / template 可以是任意可哈希的标识（例如区域元组和监视项名称），loc 为 None 时记为 (-1, -1)"""
+        channel = self.matches
+        if channel.count == channel.rows and not self._rotate(channel):
+            channel.dropped += 1
+            return
+        i = channel.count
+        times, regions, templates, scores, xs, ys = channel.active
+        times[i] = now + self.offset
+        regions[i] = self.code(region)
+        templates[i] = self.code(template)
+        scores[i] = score
+        if loc is None:
+            xs[i] = ys[i] = -1
+        else:
+            xs[i], ys[i] = loc
+        self._advance(channel)
+
+    def _advance(self, channel):
+        channel.count += 1
+        if channel.count == channel.rows or time.monotonic() - channel.opened >= self.flush_interval:
+            self._rotate(channel)
+
+    def _rotate(self, channel):
+        """把当前块交给后台线程并换上空闲块；没有空闲块时返回 False"""
+        if channel.count == 0:
+            channel.opened = time.monotonic()
+            return True
+        try:
+            spare = channel.free.popleft()
+        except IndexError:
+            return False
+        self.queue.put((channel.kind, channel.active, channel.count))
+        channel.active = spare
+        channel.count = 0
+        channel.opened = time.monotonic()
+        return True
+
+    def flush(self, timeout=5.0):
+        """写出未满的块；只应在写入线程已停止后调用（例如 close 之前）。
+        后台线程已退出或 timeout 秒内腾不出空闲块时丢弃这些事件，并记入 error"""
+        deadline = time.monotonic() + timeout
+        for channel in (self.clicks, self.matches):
+            while not self._rotate(channel):
+                if not self.thread.is_alive() or time.monotonic() >= deadline:
+                    channel.dropped += channel.count
+                    channel.count = 0
+                    self.error = self.error or "日志写入线程无响应，未写出的事件已丢弃"
+                    break
+                time.sleep(0.01)
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        self.queue.put(None)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            return
+        # 写入线程提前退出时，队列中没写出的块也计为丢弃
+        channels = {CLICKS: self.clicks, MATCHES: self.matches}
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[0] in channels:
+                channels[item[0]].dropped += item[2]
+
+    def stats(self):
+        return {"written": self.written, "dropped_clicks": self.clicks.dropped,
+                "dropped_matches": self.matches.dropped, "error": self.error}
+
+    def _write_loop(self):
+        f, day, names = None, None, {}
+        channels = {CLICKS: self.clicks, MATCHES: self.matches}
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                kind, payload, count = item
+                if kind == NAMES:
+                    names.update(payload)
+                    if f is not None:
+                        _write_names(f, payload)
+                    continue
+                channel = channels[kind]
+                try:
+                    # 按块第一行的时间决定写入哪一天的文件
+                    stamp = payload[0][0] if kind == MATCHES else payload[2][0]
+                    block_day = time.strftime("%Y-%m-%d", time.localtime(float(stamp)))
+                    if block_day != day:
+                        if f is not None:
+                            f.close()
+                            f = None
+                        f = open(journal_path(self.root, block_day, os.getpid()), "ab")
+                        day = block_day
+                        # 每个文件独立可读：写运行开始块和目前已知的全部名称
+                        f.write(HEADER.pack(MAGIC, RUN, 0))
+                        if names:
+                            _write_names(f, names)
+                    f.write(HEADER.pack(MAGIC, kind, count))
+                    for column in payload:
+                        f.write(memoryview(column[:count]))
+                    f.flush()
+                    self.written += count
+                except (OSError, ValueError, OverflowError) as e:  # 磁盘错误或时间无法换算成日期
+                    self.error = str(e)
+                    channel.dropped += count
+                finally:
+                    channel.free.append(payload)
+        except Exception as e:
+            self.error = f"日志写入线程异常退出: {str(e)}"
+        finally:
+            if f is not None:
+                f.close()
+
+
+def journal_path(root, day, pid):
+    return os.path.join(root, f"{day}-{pid}.journal")
+
+
+def _write_names(f, names):
+    data = json.dumps({str(k): v for k, v in names.items()}, ensure_ascii=False).encode("utf-8")
+    f.write(HEADER.pack(MAGIC, NAMES, len(data)))
+    f.write(data)
+
+
+def _empty(columns):
+    return {name: np.empty(0, dtype) for name, dtype in columns}
+
+
+def read_journal(path):
+    """读取一个日志文件，返回 {"names": [...], "clicks": {列: 数组}, "matches": {列: 数组}}；
+    编号列（target / region / template）为 names 的下标。文件尾部写了一半的块被忽略"""
+    with open(path, "rb") as f:
+        data = f.read()
+    names, index = [], {}
+    remap = []  # 本次运行的编号 -> names 下标
+    parts = {CLICKS: [], MATCHES: []}
+    schemas = {CLICKS: CLICK_COLUMNS, MATCHES: MATCH_COLUMNS}
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        magic, kind, count = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError(f"日志文件格式错误: {path} (偏移 {offset})")
+        offset += HEADER.size
+        if kind == RUN:
+            remap = []
+            continue
+        if kind == NAMES:
+            if offset + count > len(data):
+                break
+            for code, name in json.loads(data[offset:offset + count].decode("utf-8")).items():
+                code = int(code)
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+                remap.extend([0] * (code + 1 - len(remap)))
+                remap[code] = index[name]
+            offset += count
+            continue
+        columns = schemas.get(kind)
+        if columns is None:
+            raise ValueError(f"日志文件格式错误: {path} (未知块类型 {kind})")
+        size = count * sum(np.dtype(dtype).itemsize for _, dtype in columns)
+        if offset + size > len(data):
+            break
+        block = {}
+        lookup = np.asarray(remap, dtype=np.uint16)
+        for name, dtype in columns:
+            column = np.frombuffer(data, dtype, count, offset)
+            offset += column.nbytes
+            block[name] = lookup[column] if name in CODE_COLUMNS else column
+        parts[kind].append(block)
+    result = {"names": names}
+    for kind, key in ((CLICKS, "clicks"), (MATCHES, "matches")):
+        blocks = parts[kind]
+        if blocks:
+            result[key] = {name: np.concatenate([b[name] for b in blocks]) for name, _ in schemas[kind]}
+        else:
+            result[key] = _empty(schemas[kind])
+    return result
+
+
+def merge_journals(journals):
+    """合并多个 read_journal 的结果：名称统一编号，点击按实际时刻、匹配按时间排序"""
+    names, index = [], {}
+    parts = {"clicks": [], "matches": []}
+    for journal in journals:
+        for name in journal["names"]:
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+        lookup = np.asarray([index[name] for name in journal["names"]] or [0], dtype=np.uint16)
+        for key in parts:
+            parts[key].append({name: lookup[column] if name in CODE_COLUMNS else column
+                               for name, column in journal[key].items()})
+    result = {"names": names}
+    for key, columns, order_by in (("clicks", CLICK_COLUMNS, "actual"), ("matches", MATCH_COLUMNS, "time")):
+        merged = {name: np.concatenate([p[name] for p in parts[key]] or [np.empty(0, dtype)])
+                  for name, dtype in columns}
+        order = np.argsort(merged[order_by], kind="stable")
+        result[key] = {name: column[order] for name, column in merged.items()}
+    return result
+
+
+def load_day(root, day=None):
+    """读取某一天（"YYYY-MM-DD"，默认今天）全部进程的日志并合并，没有文件时返回空数组"""
+    day = day or time.strftime("%Y-%m-%d")
+    paths = sorted(glob.glob(os.path.join(glob.escape(root), f"{day}*.journal")))
+    return merge_journals([read_journal(path) for path in paths])
+
+
+def summarize(journal):
+    """按点击目标统计次数和迟到量，按模板统计匹配次数和得分"""
+    names = journal["names"]
+    clicks, matches = journal["clicks"], journal["matches"]
+    summary = {"clicks": {}, "matches": {}}
+    for code in np.unique(clicks["target"]):
+        mask = clicks["target"] == code
+        lateness = (clicks["actual"][mask] - clicks["scheduled"][mask]) * 1000
+        lateness = lateness[~np.isnan(lateness)]
+        summary["clicks"][names[code]] = {
+            "count": int(mask.sum()),
+            "scheduled": int(lateness.size),
+            "p50_lateness_ms": round(float(np.percentile(lateness, 50)), 3) if lateness.size else None,
+            "p99_lateness_ms": round(float(np.percentile(lateness, 99)), 3) if lateness.size else None,
+        }
+    for code in np.unique(matches["template"]):
+        scores = matches["score"][matches["template"] == code]
+        summary["matches"][names[code]] = {
+            "frames": int(scores.size),
+            "mean_score": round(float(scores.mean()), 4),
+            "max_score": round(float(scores.max()), 4),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="事件日志查看")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="按点击目标和模板汇总")
+    summary.add_argument("paths", nargs="+", help="日志文件或日志目录（目录时读取 --day 当天的全部文件）")
+    summary.add_argument("--day", help="YYYY-MM-DD，默认今天")
+    args = parser.parse_args(argv)
+
+    try:
+        journal = merge_journals([load_day(path, args.day) if os.path.isdir(path) else read_journal(path)
+                                  for path in args.paths])
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 2
+    print(json.dumps(summarize(journal), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
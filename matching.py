@@ -0,0 +1,724 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from metrics import NULL_TIMER
+
+
+# 全分辨率模板匹配（原始实现）
+class TemplateMatcher:
+    def __init__(self, template_gray):
+        self.template_gray = template_gray
+        self.result = None  # 上一帧的完整得分图，供局部重算复用
+        self.timer = NULL_TIMER
+
+    def match(self, gray):
+        """返回 (max_val, max_loc)，max_loc 为区域内左上角坐标"""
+        th, tw = self.template_gray.shape[:2]
+        if gray.shape[0] < th or gray.shape[1] < tw:
+            self.result = None
+            return 0.0, None
+        shape = (gray.shape[0] - th + 1, gray.shape[1] - tw + 1)
+        if self.result is None or self.result.shape != shape:
+            self.result = np.empty(shape, dtype=np.float32)
+        cv2.matchTemplate(gray, self.template_gray, cv2.TM_CCOEFF_NORMED, result=self.result)
+        self.timer.lap("match_template")
+        _, max_val, _, max_loc = cv2.minMaxLoc(self.result)
+        self.timer.lap("min_max_loc")
+        return max_val, max_loc
+
+    def match_rects(self, gray, rects):
+        """只重算受变化矩形 (x0, y0, x1, y1) 影响的得分，其余沿用上一帧的得分图"""
+        th, tw = self.template_gray.shape[:2]
+        if self.result is None or self.result.shape != (gray.shape[0] - th + 1, gray.shape[1] - tw + 1):
+            return self.match(gray)
+        rh, rw = self.result.shape
+        for x0, y0, x1, y1 in rects:
+            # 得分 (ry, rx) 覆盖像素 [ry, ry + th) x [rx, rx + tw)
+            ry0, ry1 = max(0, y0 - th + 1), min(rh, y1)
+            rx0, rx1 = max(0, x0 - tw + 1), min(rw, x1)
+            if ry0 >= ry1 or rx0 >= rx1:
+                continue
+            cv2.matchTemplate(gray[ry0:ry1 + th - 1, rx0:rx1 + tw - 1], self.template_gray,
+                              cv2.TM_CCOEFF_NORMED, result=self.result[ry0:ry1, rx0:rx1])
+        self.timer.lap("match_template")
+        _, max_val, _, max_loc = cv2.minMaxLoc(self.result)
+        self.timer.lap("min_max_loc")
+        return max_val, max_loc
+
+
+TILED_MIN_AREA = 1000 * 1000  # 区域面积小于该值时分块的调度开销大于收益
+TILE_MIN_ROWS = 64  # 每块至少包含的得分行数
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def budget_workers(workers, cpu_budget=0.5):
+    """按 CPU 预算限制并行线程数：最多占用 cpu_budget 比例的核心，并给点击线程留出一个核心"""
+    cores = os.cpu_count() or 1
+    limit = max(1, min(int(cores * cpu_budget), cores - 1))
+    return max(1, min(workers, limit))
+
+
+def get_match_pool(workers):
+    """同一线程数的匹配器共用一个线程池"""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ThreadPoolExecutor(workers, thread_name_prefix="match")
+        return pool
+
+
+# 分块并行匹配：按行切成相互重叠（重叠 = 模板高度 - 1）的条带，在线程池中并行 matchTemplate
+# （OpenCV 计算时释放 GIL），各块直接写入完整得分图的对应行，再合并各块的最大值
+class TiledMatcher(TemplateMatcher):
+    def __init__(self, template_gray, workers=2):
+        super().__init__(template_gray)
+        self.workers = workers
+        self.pool = get_match_pool(workers)
+
+    def _match_rows(self, gray, r0, r1):
+        th = self.template_gray.shape[0]
+        cv2.matchTemplate(gray[r0:r1 + th - 1], self.template_gray, cv2.TM_CCOEFF_NORMED,
+                          result=self.result[r0:r1])
+        _, max_val, _, max_loc = cv2.minMaxLoc(self.result[r0:r1])
+        return max_val, (max_loc[0], max_loc[1] + r0)
+
+    def match(self, gray):
+        th, tw = self.template_gray.shape[:2]
+        if gray.shape[0] < th or gray.shape[1] < tw:
+            self.result = None
+            return 0.0, None
+        shape = (gray.shape[0] - th + 1, gray.shape[1] - tw + 1)
+        tiles = min(self.workers, shape[0] // TILE_MIN_ROWS)
+        if tiles < 2 or gray.shape[0] * gray.shape[1] < TILED_MIN_AREA:
+            return super().match(gray)
+        if self.result is None or self.result.shape != shape:
+            self.result = np.empty(shape, dtype=np.float32)
+        bounds = [shape[0] * i // tiles for i in range(tiles + 1)]
+        futures = [self.pool.submit(self._match_rows, gray, bounds[i], bounds[i + 1]) for i in range(tiles)]
+        best_val, best_loc = -2.0, None
+        for future in futures:
+            max_val, max_loc = future.result()
+            # 得分相同时取靠上的块，与整图 minMaxLoc 的扫描顺序一致
+            if max_val > best_val:
+                best_val, best_loc = max_val, max_loc
+        self.timer.lap("match_template")
+        return best_val, best_loc
+
+
+# 频域归一化互相关：分子用 FFT 计算，窗口均值/方差用积分图计算，得分与 TM_CCOEFF_NORMED 一致（误差约 1e-5）。
+# 模板频谱按帧尺寸缓存（可持久化到模板缓存），各缓冲区只在帧尺寸变化时分配
+class FftMatcher:
+    def __init__(self, template_gray, spectrum_store=None):
+        """spectrum_store 为模板缓存条目（CachedTemplate），用于跨进程复用模板频谱和均值/标准差"""
+        self.template_gray = template_gray
+        self.spectrum_store = spectrum_store
+        th, tw = template_gray.shape[:2]
+        self.area = th * tw
+        if spectrum_store is not None:
+            mean, std = spectrum_store.mean_std(1)
+        else:
+            mean, std = (float(v[0, 0]) for v in cv2.meanStdDev(template_gray))
+        # |T'| = sqrt(sum((T - 均值)^2)) = 标准差 * sqrt(像素数)
+        self.template_norm = std * float(np.sqrt(self.area))
+        self.template_centered = np.subtract(template_gray, mean, dtype=np.float32)
+        self.frame_shape = None
+        self.result_valid = False  # 得分图是否对应上一次匹配的帧
+        self.timer = NULL_TIMER
+
+    def _template_spectrum(self, dft_shape):
+        name = f"fft_{dft_shape[0]}x{dft_shape[1]}"
+        if self.spectrum_store is not None:
+            spectrum = self.spectrum_store.derived(name)
+            if spectrum is not None:
+                return spectrum
+        th, tw = self.template_gray.shape[:2]
+        padded = np.zeros(dft_shape, dtype=np.float32)
+        padded[:th, :tw] = self.template_centered
+        spectrum = cv2.dft(padded)
+        if self.spectrum_store is not None:
+            spectrum = self.spectrum_store.put_derived(name, spectrum)
+        return spectrum
+
+    def _prepare(self, shape):
+        height, width = shape
+        th, tw = self.template_gray.shape[:2]
+        dft_shape = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+        # 有效得分只用到 [0, h) x [0, w) 内的像素，补零区域的内容不影响结果，只需清零一次
+        self.padded = np.zeros(dft_shape, dtype=np.float32)
+        self.spectrum = np.empty(dft_shape, dtype=np.float32)
+        self.product = np.empty(dft_shape, dtype=np.float32)
+        self.correlation = np.empty(dft_shape, dtype=np.float32)
+        self.template_spectrum = self._template_spectrum(dft_shape)
+        result_shape = (height - th + 1, width - tw + 1)
+        self.window_sum = np.empty(result_shape, dtype=np.float64)
+        self.window_sqsum = np.empty(result_shape, dtype=np.float64)
+        self.result = np.empty(result_shape, dtype=np.float32)
+        self.frame_shape = shape
+
+    def match(self, gray):
+        th, tw = self.template_gray.shape[:2]
+        if gray.shape[0] < th or gray.shape[1] < tw:
+            self.result_valid = False
+            return 0.0, None
+        if self.frame_shape != gray.shape:
+            self._prepare(gray.shape)
+        height, width = gray.shape
+        rh, rw = self.result.shape
+
+        # 分子: sum(T' * I)，T' 均值为零，因此先减去整帧均值不改变结果，还能减小浮点误差
+        np.subtract(gray, float(np.mean(gray)), out=self.padded[:height, :width], casting="unsafe")
+        cv2.dft(self.padded, self.spectrum)
+        cv2.mulSpectrums(self.spectrum, self.template_spectrum, 0, self.product, conjB=True)
+        cv2.idft(self.product, self.correlation, cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+        self.timer.lap("fft")
+
+        # 分母: sqrt(窗口方差 * 像素数) * |T'|，窗口和由积分图的四个角相减得到
+        s, sq = cv2.integral2(gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        for table, out in ((s, self.window_sum), (sq, self.window_sqsum)):
+            np.subtract(table[th:, tw:], table[:-th, tw:], out=out)
+            out -= table[th:, :-tw]
+            out += table[:-th, :-tw]
+        window_sum, denominator = self.window_sum, self.window_sqsum
+        window_sum *= window_sum
+        window_sum /= self.area
+        denominator -= window_sum
+        np.maximum(denominator, 0, out=denominator)
+        np.sqrt(denominator, out=denominator)
+        denominator *= self.template_norm
+        # 与 OpenCV 相同：方差为零的平坦窗口得分为 0
+        self.result.fill(0)
+        np.divide(self.correlation[:rh, :rw], denominator, out=self.result,
+                  where=denominator > 1e-3 * self.template_norm, casting="unsafe")
+        np.clip(self.result, -1, 1, out=self.result)
+        self.result_valid = True
+        self.timer.lap("normalize")
+        _, max_val, _, max_loc = cv2.minMaxLoc(self.result)
+        self.timer.lap("min_max_loc")
+        return max_val, max_loc
+
+    def match_rects(self, gray, rects):
+        """变化矩形附近直接用 matchTemplate 重算（小窗口比整帧 FFT 便宜），其余沿用上一帧的得分图"""
+        if not self.result_valid or self.frame_shape != gray.shape:
+            return self.match(gray)
+        return TemplateMatcher.match_rects(self, gray, rects)
+
+
+def build_pyramid(image, levels):
+    """返回 [原图, 1/2, 1/4, ...] 共 levels + 1 层"""
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def pyramid_levels(template_gray, min_template_side=12, max_levels=3):
+    """模板最短边缩小后仍不小于 min_template_side 的最多层数"""
+    levels = 0
+    side = min(template_gray.shape[:2])
+    while levels < max_levels and (side >> (levels + 1)) >= min_template_side:
+        levels += 1
+    return levels
+
+
+# 由粗到细的金字塔匹配：先在缩小图上找候选，再在全分辨率上只校验候选附近
+class PyramidMatcher:
+    def __init__(self, template_gray, levels=None, top_k=3, min_template_side=12, max_levels=3,
+                 template_pyramid=None, full_matcher=None):
+        """template_pyramid 为预先算好的模板金字塔（例如来自模板缓存），层数不足时重新计算；
+        full_matcher 为候选校验失败时使用的全分辨率匹配器"""
+        self.template_gray = template_gray
+        self.top_k = top_k
+        if levels is None:
+            levels = pyramid_levels(template_gray, min_template_side, max_levels)
+        self.levels = levels
+        self.scale = 1 << levels
+        # 模板各层只在构造时计算一次
+        if template_pyramid is not None and len(template_pyramid) > levels:
+            self.template_pyramid = list(template_pyramid[:levels + 1])
+        else:
+            self.template_pyramid = build_pyramid(template_gray, levels)
+        self.full_matcher = full_matcher if full_matcher is not None else TemplateMatcher(template_gray)
+        self._frame_buffers = [None] * (levels + 1)
+        self.last_result = None
+        self.timer = NULL_TIMER
+
+    def _downscale(self, gray):
+        src = gray
+        for level in range(1, self.levels + 1):
+            shape = ((src.shape[0] + 1) // 2, (src.shape[1] + 1) // 2)
+            buf = self._frame_buffers[level]
+            if buf is None or buf.shape != shape:
+                buf = np.empty(shape, dtype=gray.dtype)
+                self._frame_buffers[level] = buf
+            cv2.pyrDown(src, dst=buf, dstsize=(shape[1], shape[0]))
+            src = buf
+        return src
+
+    def match(self, gray):
+        self.last_result = self._search(gray)
+        return self.last_result
+
+    def match_rects(self, gray, rects):
+        """金字塔没有完整得分图：上次最佳位置不受变化影响时沿用其得分，
+        只在变化矩形附近按全分辨率重算；最佳位置被改动时整帧重新搜索"""
+        if self.last_result is None or self.last_result[1] is None:
+            return self.match(gray)
+        best_val, best_loc = self.last_result
+        th, tw = self.template_gray.shape[:2]
+        bx, by = best_loc
+        for x0, y0, x1, y1 in rects:
+            if x0 < bx + tw and bx < x1 and y0 < by + th and by < y1:
+                return self.match(gray)
+        height, width = gray.shape[:2]
+        for x0, y0, x1, y1 in rects:
+            wx0, wy0 = max(0, x0 - tw + 1), max(0, y0 - th + 1)
+            wx1, wy1 = min(width, x1 + tw - 1), min(height, y1 + th - 1)
+            if wy1 - wy0 < th or wx1 - wx0 < tw:
+                continue
+            window_res = cv2.matchTemplate(gray[wy0:wy1, wx0:wx1], self.template_gray, cv2.TM_CCOEFF_NORMED)
+            self.timer.lap("match_template")
+            _, val, _, loc = cv2.minMaxLoc(window_res)
+            self.timer.lap("min_max_loc")
+            if val > best_val:
+                best_val, best_loc = val, (wx0 + loc[0], wy0 + loc[1])
+        self.last_result = (best_val, best_loc)
+        return self.last_result
+
+    def _search(self, gray):
+        coarse_template = self.template_pyramid[-1]
+        th, tw = self.template_gray.shape[:2]
+        if self.levels == 0 or gray.shape[0] < th or gray.shape[1] < tw:
+            return self.full_matcher.match(gray)
+
+        coarse = self._downscale(gray)
+        self.timer.lap("pyramid")
+        if coarse.shape[0] < coarse_template.shape[0] or coarse.shape[1] < coarse_template.shape[1]:
+            return self.full_matcher.match(gray)
+        res = cv2.matchTemplate(coarse, coarse_template, cv2.TM_CCOEFF_NORMED)
+        self.timer.lap("match_template")
+
+        # 取前 top_k 个候选，每取一个就把其邻域压掉（非极大值抑制）
+        ch, cw = coarse_template.shape[:2]
+        candidates = []
+        for _ in range(self.top_k):
+            _, val, _, loc = cv2.minMaxLoc(res)
+            if not np.isfinite(val) or val <= -1:
+                break
+            candidates.append(loc)
+            cx, cy = loc
+            res[max(0, cy - ch // 2):cy + ch // 2 + 1, max(0, cx - cw // 2):cx + cw // 2 + 1] = -1
+        self.timer.lap("min_max_loc")
+
+        # 在全分辨率上只校验候选附近的小窗口，得分与 TM_CCOEFF_NORMED 完全一致
+        best_val, best_loc = -1.0, None
+        margin = self.scale
+        height, width = gray.shape[:2]
+        for cx, cy in candidates:
+            x0 = max(0, cx * self.scale - margin)
+            y0 = max(0, cy * self.scale - margin)
+            x1 = min(width, cx * self.scale + margin + tw)
+            y1 = min(height, cy * self.scale + margin + th)
+            if y1 - y0 < th or x1 - x0 < tw:
+                continue
+            window_res = cv2.matchTemplate(gray[y0:y1, x0:x1], self.template_gray, cv2.TM_CCOEFF_NORMED)
+            self.timer.lap("match_template")
+            _, val, _, loc = cv2.minMaxLoc(window_res)
+            self.timer.lap("min_max_loc")
+            if val > best_val:
+                best_val, best_loc = val, (x0 + loc[0], y0 + loc[1])
+        if best_loc is None:
+            return self.full_matcher.match(gray)
+        return best_val, best_loc
+
+
+# 帧变化检测：与上一帧逐块比较，返回变化块的外接矩形
+class ChangeDetector:
+    SAME = "same"
+    PARTIAL = "partial"
+    FULL = "full"
+
+    def __init__(self, tile=32, max_dirty_ratio=0.5):
+        self.tile = tile
+        self.max_dirty_ratio = max_dirty_ratio
+        self.prev = None
+        self.diff = None
+
+    def reset(self):
+        self.prev = None
+
+    def detect(self, gray):
+        """返回 (状态, 变化矩形列表)，矩形为 (x0, y0, x1, y1) 像素坐标"""
+        if self.prev is None or self.prev.shape != gray.shape:
+            self.prev = gray.copy()
+            self.diff = np.empty_like(gray)
+            return self.FULL, None
+
+        cv2.absdiff(gray, self.prev, dst=self.diff)
+        if cv2.countNonZero(self.diff) == 0:
+            return self.SAME, None
+        np.copyto(self.prev, gray)
+
+        # 每个块取最大差值，得到一张很小的块变化掩码
+        height, width = gray.shape
+        ys = np.arange(0, height, self.tile)
+        xs = np.arange(0, width, self.tile)
+        tile_max = np.maximum.reduceat(np.maximum.reduceat(self.diff, ys, axis=0), xs, axis=1)
+        mask = (tile_max > 0).astype(np.uint8)
+        if cv2.countNonZero(mask) > self.max_dirty_ratio * mask.size:
+            return self.FULL, None
+
+        # 相邻的变化块合并成一个矩形
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        rects = []
+        for i in range(1, count):
+            tx, ty, tw, th = stats[i, :4]
+            rects.append((tx * self.tile, ty * self.tile,
+                          min(width, (tx + tw) * self.tile), min(height, (ty + th) * self.tile)))
+        return self.PARTIAL, rects
+
+
+# 变化门控：画面没变时直接沿用上次结果，局部变化时只重算变化附近
+class ChangeGatedMatcher:
+    def __init__(self, inner, tile=32, max_dirty_ratio=0.5):
+        self.inner = inner
+        self.detector = ChangeDetector(tile, max_dirty_ratio)
+        self.last_result = None
+        self.skipped = 0  # 因画面未变跳过的帧数
+        self.partial = 0  # 局部重算的帧数
+        self.timer = NULL_TIMER
+
+    def match(self, gray):
+        state, rects = self.detector.detect(gray)
+        self.timer.lap("change_detect")
+        return self.match_changed(gray, state, rects)
+
+    def match_changed(self, gray, state, rects):
+        """按外部已算好的变化检测结果匹配，多个模板共享同一区域时只需检测一次"""
+        if state == ChangeDetector.SAME and self.last_result is not None:
+            self.skipped += 1
+            return self.last_result
+        if state == ChangeDetector.PARTIAL and self.last_result is not None and hasattr(self.inner, "match_rects"):
+            self.partial += 1
+            self.last_result = self.inner.match_rects(gray, rects)
+        else:
+            self.last_result = self.inner.match(gray)
+        return self.last_result
+
+
+# 命中跟踪：先在上次命中位置附近的小窗口里找，逐级扩大，全部未命中才整区域搜索
+class RoiTracker:
+    def __init__(self, inner, template_gray, threshold, margins=(4, 16, 64)):
+        self.inner = inner
+        self.template_gray = template_gray
+        self.threshold = threshold
+        self.margins = margins
+        self.last_loc = None
+        self.window_hits = [0] * len(margins)  # 每一级窗口的命中次数
+        self.full_searches = 0
+        self.partial_searches = 0  # 只重算变化矩形的区域搜索次数
+        self.inner_stale = True  # 窗口命中的帧没有经过内层，内层得分图不再对应上一帧
+        self.timer = NULL_TIMER
+
+    def reset(self):
+        self.last_loc = None
+
+    def match(self, gray):
+        return self._search(gray, None)
+
+    def match_rects(self, gray, rects):
+        """窗口未命中时，内层得分图对应上一帧才只重算变化矩形，否则整区域搜索"""
+        return self._search(gray, rects)
+
+    def _search(self, gray, rects):
+        if self.last_loc is not None:
+            th, tw = self.template_gray.shape[:2]
+            height, width = gray.shape[:2]
+            lx, ly = self.last_loc
+            for level, margin in enumerate(self.margins):
+                x0, y0 = max(0, lx - margin), max(0, ly - margin)
+                x1, y1 = min(width, lx + tw + margin), min(height, ly + th + margin)
+                if y1 - y0 < th or x1 - x0 < tw:
+                    continue
+                res = cv2.matchTemplate(gray[y0:y1, x0:x1], self.template_gray, cv2.TM_CCOEFF_NORMED)
+                self.timer.lap("match_template")
+                _, val, _, loc = cv2.minMaxLoc(res)
+                self.timer.lap("min_max_loc")
+                if val >= self.threshold:
+                    self.window_hits[level] += 1
+                    self.last_loc = (x0 + loc[0], y0 + loc[1])
+                    self.inner_stale = True
+                    return val, self.last_loc
+
+        if rects is not None and not self.inner_stale and hasattr(self.inner, "match_rects"):
+            self.partial_searches += 1
+            max_val, max_loc = self.inner.match_rects(gray, rects)
+        else:
+            self.full_searches += 1
+            max_val, max_loc = self.inner.match(gray)
+        self.inner_stale = False
+        self.last_loc = max_loc if max_val >= self.threshold else None
+        return max_val, max_loc
+
+
+# 预筛选：在完整匹配前用廉价的必要条件排除明显不可能匹配的帧，各阶段共享一张缩小后的帧
+class HistogramPrefilter:
+    """灰度直方图：模板的像素分布需要大部分出现在区域中（假设没有明显的整体亮度变化）"""
+    name = "histogram"
+
+    def __init__(self, template_gray, bins=16, min_overlap=0.6):
+        self.bins = bins
+        self.min_overlap = min_overlap
+        self.template_hist = cv2.calcHist([np.ascontiguousarray(template_gray)], [0], None, [bins], [0, 256])
+        self.template_pixels = float(template_gray.size)
+        self.overlap = np.empty_like(self.template_hist)
+
+    def accept(self, gray, small):
+        hist = cv2.calcHist([gray], [0], None, [self.bins], [0, 256])
+        np.minimum(hist, self.template_hist, out=self.overlap)
+        return float(self.overlap.sum()) >= self.min_overlap * self.template_pixels
+
+
+class VariancePrefilter:
+    """积分图窗口方差：区域中至少有一个窗口的对比度接近模板，平坦画面直接排除"""
+    name = "variance"
+
+    def __init__(self, template_small, min_std_ratio=0.25, template_std=None):
+        """template_std 为缩小模板的标准差（来自模板缓存），省略时现算"""
+        self.th, self.tw = template_small.shape[:2]
+        if template_std is None:
+            template_std = float(np.std(template_small))
+        self.min_std = min_std_ratio * template_std
+
+    def accept(self, gray, small):
+        if self.min_std <= 0:
+            return True
+        th, tw, n = self.th, self.tw, self.th * self.tw
+        s, sq = cv2.integral2(small, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        window_sum = s[th:, tw:] - s[:-th, tw:] - s[th:, :-tw] + s[:-th, :-tw]
+        window_sqsum = sq[th:, tw:] - sq[:-th, tw:] - sq[th:, :-tw] + sq[:-th, :-tw]
+        max_var = float(np.max(window_sqsum - window_sum * window_sum / n)) / n
+        return max_var >= self.min_std * self.min_std
+
+
+class CoarsePrefilter:
+    """缩小尺度的相关：缩小图上的最高得分低于 threshold * 最差相位得分 - margin 时排除"""
+    name = "coarse"
+
+    def __init__(self, template_gray, template_small, scale, threshold, margin=0.2):
+        self.template_small = template_small
+        # 模板相对缩小网格的位置不同，完全相同的副本在缩小图上的得分也不同（可低至 0.5 左右），
+        # 按模板自身在各相位下的最差得分放宽下限，真实匹配不会被排除
+        self.worst_phase = self.phase_floor(template_gray, template_small, scale)
+        self.min_score = threshold * self.worst_phase - margin
+
+    @staticmethod
+    def phase_floor(template_gray, template_small, scale):
+        """把模板放在均值背景上的 scale x scale 种偏移处缩小，返回与缩小模板的最低相关得分"""
+        if scale <= 1:
+            return 1.0
+        th, tw = template_gray.shape[:2]
+        canvas = np.empty((th + 2 * scale, tw + 2 * scale), dtype=np.uint8)
+        size = (canvas.shape[1] // scale, canvas.shape[0] // scale)
+        worst = 1.0
+        for dy in range(scale):
+            for dx in range(scale):
+                canvas[:] = int(template_gray.mean())
+                canvas[scale + dy:scale + dy + th, scale + dx:scale + dx + tw] = template_gray
+                small = cv2.resize(canvas, size, interpolation=cv2.INTER_AREA)
+                _, score, _, _ = cv2.minMaxLoc(cv2.matchTemplate(small, template_small, cv2.TM_CCOEFF_NORMED))
+                worst = min(worst, score)
+        return worst
+
+    def accept(self, gray, small):
+        _, max_val, _, _ = cv2.minMaxLoc(cv2.matchTemplate(small, self.template_small, cv2.TM_CCOEFF_NORMED))
+        return max_val >= self.min_score
+
+
+PREFILTER_STAGES = ("histogram", "variance", "coarse")
+
+
+def shrink(image, scale, dst=None):
+    """按整数倍缩小（INTER_AREA），预筛选的缩小帧和缩小模板都用它，模板缓存按同样方式统计均值/标准差"""
+    if scale == 1:
+        return np.ascontiguousarray(image)
+    size = (image.shape[1] // scale, image.shape[0] // scale)
+    return cv2.resize(image, size, dst=dst, interpolation=cv2.INTER_AREA)
+
+
+# 预筛选级联：按顺序执行各阶段，任一阶段排除即返回 (0.0, None)，全部通过才交给内层匹配器
+class PrefilterCascade:
+    def __init__(self, inner, template_gray, threshold, stages=PREFILTER_STAGES, scale=4, min_template_side=8,
+                 template_stats=None):
+        """template_stats 为模板缓存条目（CachedTemplate），提供各缩小倍数下模板的均值/标准差"""
+        self.inner = inner
+        # 缩小倍数以模板缩小后最短边不小于 min_template_side 为限
+        side = min(template_gray.shape[:2])
+        while scale > 1 and side // scale < min_template_side:
+            scale //= 2
+        self.scale = scale
+        template_small = self._shrink(template_gray)
+        self.stages = []
+        for name in stages:
+            if name == "histogram":
+                self.stages.append(HistogramPrefilter(template_gray))
+            elif name == "variance":
+                std = template_stats.mean_std(self.scale)[1] if template_stats is not None else None
+                self.stages.append(VariancePrefilter(template_small, template_std=std))
+            elif name == "coarse":
+                self.stages.append(CoarsePrefilter(template_gray, template_small, self.scale, threshold))
+            else:
+                raise ValueError(f"未知的预筛选阶段: {name}")
+        self.template_small = template_small
+        self.frames = 0
+        self.passed = 0
+        self.rejected = {stage.name: 0 for stage in self.stages}
+        self.inner_stale = True  # 被排除的帧没有经过内层，内层得分图不再对应上一帧
+        self._small = None
+        self.timer = NULL_TIMER
+
+    def _shrink(self, image, dst=None):
+        return shrink(image, self.scale, dst)
+
+    def match(self, gray):
+        return self._filter(gray, None)
+
+    def match_rects(self, gray, rects):
+        """预筛选仍看整帧，通过后内层得分图对应上一帧时只重算变化矩形"""
+        return self._filter(gray, rects)
+
+    def _filter(self, gray, rects):
+        th, tw = self.template_small.shape[:2]
+        if gray.shape[0] // self.scale < th or gray.shape[1] // self.scale < tw:
+            return self._match_inner(gray, rects)
+        self.frames += 1
+        shape = (gray.shape[0] // self.scale, gray.shape[1] // self.scale)
+        if self._small is None or self._small.shape != shape:
+            self._small = np.empty(shape, dtype=np.uint8)
+        small = self._shrink(gray, self._small) if self.scale > 1 else gray
+        self.timer.lap("prefilter_shrink")
+        for stage in self.stages:
+            accepted = stage.accept(gray, small)
+            self.timer.lap(f"prefilter_{stage.name}")
+            if not accepted:
+                self.rejected[stage.name] += 1
+                self.inner_stale = True
+                return 0.0, None
+        self.passed += 1
+        return self._match_inner(gray, rects)
+
+    def _match_inner(self, gray, rects):
+        if rects is not None and not self.inner_stale and hasattr(self.inner, "match_rects"):
+            result = self.inner.match_rects(gray, rects)
+        else:
+            result = self.inner.match(gray)
+        self.inner_stale = False
+        return result
+
+    def stats(self):
+        """各阶段排除的帧数，以及通过全部阶段进入完整匹配的帧数"""
+        return {"frames": self.frames, "passed": self.passed, "rejected": dict(self.rejected)}
+
+
+def find_matcher(matcher, cls):
+    """在匹配器链中查找指定类型的一层（例如预筛选级联），没有时返回 None"""
+    while matcher is not None:
+        if isinstance(matcher, cls):
+            return matcher
+        matcher = getattr(matcher, "inner", None)
+    return None
+
+
+# 持续匹配判定：连续匹配达到 hold_seconds 时触发一次，然后重新计时
+class PersistenceTracker:
+    def __init__(self, hold_seconds=5):
+        self.hold_seconds = hold_seconds
+        self.match_start_time = None
+
+    def update(self, matched, now):
+        if not matched:
+            self.match_start_time = None  # 匹配中断则重置计时器
+            return False
+        if self.match_start_time is None:
+            self.match_start_time = now  # 第一次检测到匹配时记录时间
+        elif now - self.match_start_time >= self.hold_seconds:
+            self.match_start_time = None  # 重置计时器
+            return True
+        return False
+
+
+# 单帧判定：匹配 + 持续时间判断，检测线程和离线回放共用同一份逻辑
+class MatchEvaluator:
+    def __init__(self, matcher, threshold, hold_seconds=5):
+        self.matcher = matcher
+        self.threshold = threshold
+        self.persistence = PersistenceTracker(hold_seconds)
+
+    def evaluate(self, gray, now):
+        """返回 (max_val, max_loc, 是否匹配, 是否达到持续时间)"""
+        max_val, max_loc = self.matcher.match(gray)
+        matched = max_val >= self.threshold
+        return max_val, max_loc, matched, self.persistence.update(matched, now)
+
+
+# 匹配模式: full-全分辨率, pyramid-金字塔, fft-频域, auto-按区域和模板大小自动选择
+MATCH_MODES = ("auto", "full", "pyramid", "fft")
+PYRAMID_MIN_AREA = 400 * 400  # 区域面积超过该值时 auto 模式使用金字塔匹配
+# 区域较小时，模板边长不小于该值且面积占区域的比例不低于 FFT_MIN_AREA_RATIO 时 auto 模式使用频域匹配
+FFT_MIN_TEMPLATE_SIDE = 128
+FFT_MIN_AREA_RATIO = 0.12
+
+
+def attach_timer(matcher, timer):
+    """把分段计时器挂到匹配器链的每一层，匹配耗时细分为 match_template / min_max_loc 等阶段"""
+    while matcher is not None:
+        matcher.timer = timer
+        if isinstance(matcher, PyramidMatcher):
+            matcher.full_matcher.timer = timer
+        matcher = getattr(matcher, "inner", None)
+
+
+def choose_match_mode(template_gray, region):
+    area = 0
+    if region is not None:
+        x1, y1, x2, y2 = region
+        area = (x2 - x1) * (y2 - y1)
+    if area >= PYRAMID_MIN_AREA:
+        return "pyramid"
+    th, tw = template_gray.shape[:2]
+    if area and min(th, tw) >= FFT_MIN_TEMPLATE_SIDE and th * tw >= FFT_MIN_AREA_RATIO * area:
+        return "fft"
+    return "full"
+
+
+def create_matcher(template_gray, mode="auto", region=None, change_gate=False, track_threshold=None,
+                   template_pyramid=None, spectrum_store=None, prefilter=None, prefilter_threshold=0.9,
+                   workers=1, cpu_budget=0.5):
+    """template_pyramid / spectrum_store 来自模板缓存（后者同时提供模板频谱和均值/标准差），可省去构造时的预处理；
+    prefilter 为预筛选阶段名序列（见 PREFILTER_STAGES），命中跟踪窗口不经过预筛选；
+    workers > 1 时大区域的全分辨率匹配分块并行，实际线程数受 cpu_budget 限制"""
+    if mode not in MATCH_MODES:
+        raise ValueError(f"未知的匹配模式: {mode}")
+    if mode == "auto":
+        mode = choose_match_mode(template_gray, region)
+    workers = budget_workers(workers, cpu_budget)
+    full_matcher = TiledMatcher(template_gray, workers) if workers > 1 else TemplateMatcher(template_gray)
+    if mode == "pyramid":
+        matcher = PyramidMatcher(template_gray, template_pyramid=template_pyramid, full_matcher=full_matcher)
+    elif mode == "fft":
+        matcher = FftMatcher(template_gray, spectrum_store)
+    else:
+        matcher = full_matcher
+    if prefilter:
+        threshold = track_threshold if track_threshold is not None else prefilter_threshold
+        matcher = PrefilterCascade(matcher, template_gray, threshold, prefilter, template_stats=spectrum_store)
+    if track_threshold is not None:
+        matcher = RoiTracker(matcher, template_gray, track_threshold)
+    if change_gate:
+        matcher = ChangeGatedMatcher(matcher)
+    return matcher
@@ -0,0 +1,151 @@
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 固定的对数桶边界：1µs 到约 16s，每倍频 4 个桶，分位数误差不超过约 19%
+BUCKET_BOUNDS = tuple(1e-6 * 2 ** (i / 4) for i in range(97))
+
+
+# 固定大小的耗时直方图：记录 O(log 桶数)，内存不随样本数增长；每个直方图只应由一个线程写入
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """返回样本所在桶的上界（不超过最大值），q 取 0~1"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target and count:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+# 分段计时：每次 lap 记录距上一次 lap（或 start）的耗时，各段之和即一轮的总耗时
+class StageTimer:
+    def __init__(self, metrics, prefix, clock=time.perf_counter):
+        self.metrics = metrics
+        self.prefix = prefix
+        self.clock = clock
+        self.last = 0.0
+
+    def start(self):
+        self.last = self.clock()
+
+    def lap(self, stage):
+        now = self.clock()
+        self.metrics.record(self.prefix + stage, now - self.last)
+        self.last = now
+
+
+# 关闭统计时使用的空计时器，热路径上只剩一次空方法调用
+class _NullStageTimer:
+    def start(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+
+NULL_TIMER = _NullStageTimer()
+
+
+# 指标表：按名称保存耗时直方图，可导出为 JSON 文件或通过本机 HTTP 端口查看
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.sources = {}  # 名称 -> 返回计数字典的函数，快照时调用（例如预筛选各阶段的排除帧数）
+        self.server = None
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def add_source(self, name, source):
+        """附加计数类统计：snapshot 时调用 source()，结果放在 name 下"""
+        with self.lock:
+            self.sources[name] = source
+
+    def timer(self, prefix=""):
+        """返回分段计时器，未启用时返回空计时器"""
+        return StageTimer(self, prefix) if self.enabled else NULL_TIMER
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.histograms.items())
+            sources = list(self.sources.items())
+        snapshot = {name: histogram.snapshot() for name, histogram in sorted(items)}
+        for name, source in sources:
+            snapshot[name] = source()
+        return snapshot
+
+    def dump(self, path):
+        """先写临时文件再替换，读取方不会看到写了一半的文件"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def serve(self, port=0, host="127.0.0.1"):
+        """在后台线程启动只读 HTTP 端口，GET 任意路径返回当前快照，返回实际监听的端口"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address[1]
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+DISABLED = Metrics(enabled=False)
@@ -0,0 +1,269 @@
+import threading
+from collections import namedtuple
+
+from clocks import SYSTEM_CLOCK
+from frame_pipeline import FramePipeline
+from matching import (ChangeDetector, ChangeGatedMatcher, PersistenceTracker, PrefilterCascade, attach_timer,
+                      create_matcher, find_matcher)
+from metrics import NULL_TIMER
+from poll_governor import ACTIVE, IDLE, URGENT, PollGovernor
+
+# 单个监视项一轮的匹配结果，loc 为屏幕坐标
+MatchResult = namedtuple("MatchResult", "name score loc matched persistent")
+
+
+# 一个监视项：一张模板 + 一个屏幕区域 (x1, y1, x2, y2)
+class MatchWatch:
+    def __init__(self, name, template_gray, region, threshold=0.9, hold_seconds=5, match_mode="auto",
+                 track_roi=True, template_entry=None, prefilter=None, workers=1, cpu_budget=0.5, change_gate=True):
+        """template_entry 为模板缓存条目，提供预先算好的金字塔和频谱；
+        change_gate 为 False 时每帧都整区域匹配，不复用上一帧的结果"""
+        self.name = name
+        self.template_gray = template_gray
+        self.region = tuple(region)
+        self.threshold = threshold
+        self.change_gate = change_gate
+        self.matcher = ChangeGatedMatcher(create_matcher(
+            template_gray, match_mode, region, track_threshold=threshold if track_roi else None,
+            template_pyramid=template_entry.pyramid if template_entry else None, spectrum_store=template_entry,
+            prefilter=prefilter, prefilter_threshold=threshold, workers=workers, cpu_budget=cpu_budget))
+        self.prefilter = find_matcher(self.matcher, PrefilterCascade)
+        self.persistence = PersistenceTracker(hold_seconds)
+
+
+def find_monitor(monitors, region):
+    """返回包含区域左上角的显示器序号（mss 的 monitors[0] 是全部屏幕的合集）"""
+    x1, y1 = region[0], region[1]
+    for index, mon in enumerate(monitors[1:], 1):
+        if mon["left"] <= x1 < mon["left"] + mon["width"] and mon["top"] <= y1 < mon["top"] + mon["height"]:
+            return index
+    return 0
+
+
+def plan_capture(monitors, regions):
+    """按显示器合并区域，返回 [(显示器序号, (left, top, right, bottom)), ...]"""
+    by_monitor = {}
+    for region in regions:
+        by_monitor.setdefault(find_monitor(monitors, region), []).append(region)
+    plan = []
+    for index, rs in sorted(by_monitor.items()):
+        plan.append((index, (min(r[0] for r in rs), min(r[1] for r in rs),
+                             max(r[2] for r in rs), max(r[3] for r in rs))))
+    return plan
+
+
+# 同一显示器上的区域合并为一次截图，各区域从灰度图上切视图
+class CaptureGroup:
+    def __init__(self, monitor_index, bbox):
+        self.monitor_index = monitor_index
+        self.left, self.top, self.right, self.bottom = bbox
+        self.width, self.height = self.right - self.left, self.bottom - self.top
+        self.grab_rect = {"left": self.left, "top": self.top, "width": self.width, "height": self.height}
+        # 区域 -> (共享的变化检测器, 该区域上的所有监视项)
+        self.regions = {}
+
+    def contains(self, region):
+        x1, y1, x2, y2 = region
+        return self.left <= x1 and self.top <= y1 and x2 <= self.right and y2 <= self.bottom
+
+    def add(self, watch):
+        entry = self.regions.get(watch.region)
+        if entry is None:
+            entry = (ChangeDetector(), [])
+            self.regions[watch.region] = entry
+        entry[1].append(watch)
+
+
+# 多模板、多区域匹配引擎：每轮每个显示器只截图一次，共享区域的模板一起匹配
+class MultiMatchEngine:
+    def __init__(self, watches, pipeline=None):
+        self.watches = list(watches)
+        self.pipeline = pipeline if pipeline is not None else FramePipeline()
+        self.groups = []
+        self.recorders = {}  # 区域 -> FrameRecorder，录制该区域每帧的灰度图
+        self.timer = NULL_TIMER
+
+    def set_timer(self, timer):
+        """启用分段耗时统计，计时器同时挂到每个监视项的匹配器上"""
+        self.timer = timer
+        for watch in self.watches:
+            attach_timer(watch.matcher, timer)
+
+    def bind(self, monitors):
+        """按显示器划分截图分组，显示器布局变化后需重新调用"""
+        self.bind_plan(plan_capture(monitors, [w.region for w in self.watches]))
+
+    def bind_plan(self, plan):
+        self.groups = [CaptureGroup(index, bbox) for index, bbox in plan]
+        for watch in self.watches:
+            for group in self.groups:
+                if group.contains(watch.region):
+                    group.add(watch)
+                    break
+
+    def tick(self, source, clock=None):
+        """用截图来源完成一轮检测，返回 (本轮时间戳, [MatchResult, ...])；
+        给定 clock 时时间戳取自 clock，否则使用截图时间戳（例如回放录制的时刻）"""
+        self.timer.start()
+        now = source.begin_frame()
+        if clock is not None:
+            now = clock()
+        results = []
+        for group in self.groups:
+            if group.regions:
+                frame = source.grab(group.grab_rect)
+                self.timer.lap("grab")
+                gray = self.pipeline.to_gray(frame, key=("monitor", group.monitor_index))
+                self.timer.lap("convert")
+                self.match_group(group, gray, now, results)
+        return now, results
+
+    def match_group(self, group, gray, now, results):
+        """在一个分组的灰度图上匹配该分组的全部监视项，结果追加到 results"""
+        for region, (detector, watches) in group.regions.items():
+            x1, y1, x2, y2 = region
+            view = gray[y1 - group.top:y2 - group.top, x1 - group.left:x2 - group.left]
+            # 同一区域只做一次变化检测，结果供该区域上所有模板复用
+            state, rects = detector.detect(view)
+            self.timer.lap("change_detect")
+            recorder = self.recorders.get(region)
+            if recorder is not None:
+                recorder.append(view, now)
+                self.timer.lap("record")
+            for watch in watches:
+                if watch.change_gate:
+                    score, loc = watch.matcher.match_changed(view, state, rects)
+                else:
+                    score, loc = watch.matcher.match_changed(view, ChangeDetector.FULL, None)
+                matched = score >= watch.threshold
+                persistent = watch.persistence.update(matched, now)
+                self.timer.lap("evaluate")
+                if loc is not None:
+                    loc = (loc[0] + x1, loc[1] + y1)
+                results.append(MatchResult(watch.name, score, loc, matched, persistent))
+
+
+def publish_match_result(telemetry, result):
+    telemetry.set(("match", result.name, "matched"), result.matched)
+    telemetry.set(("match", result.name, "score"), round(result.score, 2))  # 取两位小数，避免微小抖动刷新界面
+
+
+# 不依赖 Qt 的多模板检测循环：界面的 TemplateMatcherThread 和 headless.py 在线程中调用 run，
+# simulation.py 用 open_source / step 按虚拟时钟逐步驱动
+class MultiMatchRunner:
+    def __init__(self, watches, poll_interval=0.1, telemetry=None, on_persistent=None, capture_factory=None,
+                 metrics=None, rules=None, journal=None, poll_cpu_budget=0.25, clock=None):
+        """poll_cpu_budget 为检测线程自身最多占用单个核心的比例，0 表示不限制；
+        clock 为可注入的时钟（例如虚拟时钟），设置后持续时间、事件日志和规则都按它计时，
+        轮询等待也由它完成，默认使用截图时间戳"""
+        self.engine = MultiMatchEngine(watches)
+        if metrics is not None and metrics.enabled:
+            self.engine.set_timer(metrics.timer("match."))
+            # 截图 -> 灰度的帧数、每帧拷贝字节数和缓冲分配量，用于确认零拷贝流水线没有退化
+            metrics.add_source("match.pipeline", self.engine.pipeline.stats)
+            if any(watch.prefilter is not None for watch in self.engine.watches):
+                metrics.add_source("match.prefilter", self.prefilter_stats)
+        self.capture_factory = capture_factory  # 返回 CaptureSource 的工厂，默认实时截图
+        self.poll_interval = poll_interval
+        self.telemetry = telemetry
+        self.on_persistent = on_persistent  # 回调 (MatchResult, 检测时刻)，在检测线程中调用
+        self.rules = rules  # RuleEngine，每帧用本轮结果更新一次
+        self.journal = journal  # EventJournal，记录每个监视项每帧的得分和位置
+        self.regions = {watch.name: watch.region for watch in self.engine.watches}
+        self.clock = clock
+        # poll_interval 为基准间隔，实际间隔由自适应轮询控制；为 0 时不等待（例如离线回放）
+        self.governor = (PollGovernor(base_interval=poll_interval, cpu_budget=poll_cpu_budget,
+                                      clock=clock if clock is not None else SYSTEM_CLOCK)
+                         if poll_interval > 0 else None)
+        self.stop_event = threading.Event()
+        self.running = False
+
+    def run(self):
+        self.running = True
+        self.stop_event.clear()
+        with self.open_source() as source:
+            while self.running:
+                interval = self.step(source)
+                if interval is None:
+                    break
+                if self.governor is not None:
+                    (self.clock if self.clock is not None else SYSTEM_CLOCK).wait(self.stop_event, interval)
+        self.running = False
+
+    def open_source(self):
+        """创建截图来源并按它的显示器布局划分截图分组，返回的来源用作上下文管理器"""
+        from capture import MssCaptureSource
+
+        factory = self.capture_factory if self.capture_factory is not None else MssCaptureSource
+        source = factory()
+        try:
+            self.engine.bind(source.monitors)
+        except Exception:
+            source.close()
+            raise
+        return source
+
+    def step(self, source):
+        """完成一轮检测、回调和规则求值，返回到下一轮的等待秒数；回放结束时返回 None。
+        run 在两轮之间按返回值等待，模拟器直接调用并自行推进虚拟时钟"""
+        from capture import ReplayFinished
+
+        if self.governor is not None:
+            self.governor.begin()
+        skipped = self.skipped_frames()
+        try:
+            now, results = self.engine.tick(source, self.clock)
+        except ReplayFinished:
+            return None
+        for result in results:
+            if result.persistent and self.on_persistent is not None:
+                self.on_persistent(result, now)
+            if self.telemetry is not None:
+                publish_match_result(self.telemetry, result)
+            if self.journal is not None:
+                self.journal.record_match(now, self.regions[result.name], result.name, result.score, result.loc)
+        if self.telemetry is not None:
+            self.publish_frame(results)
+        self.engine.timer.lap("emit")
+        if self.rules is not None:
+            self.rules.evaluate(now, results)
+            self.engine.timer.lap("rules")
+        if self.governor is None:
+            return 0.0
+        interval = self.wait_interval(now, self.governor.end(self.poll_state(skipped)))
+        if self.telemetry is not None:
+            self.telemetry.set("match.poll_interval", round(interval, 3))
+        return interval
+
+    def prefilter_stats(self):
+        """各监视项预筛选的帧数、通过数和各阶段排除数，没有启用预筛选的监视项不列出"""
+        return {watch.name: watch.prefilter.stats() for watch in self.engine.watches if watch.prefilter is not None}
+
+    def publish_frame(self, results):
+        """整体匹配状态和各监视项的预筛选排除计数"""
+        self.telemetry.set("match.matched", any(r.matched for r in results))
+        for watch in self.engine.watches:
+            if watch.prefilter is not None:
+                self.telemetry.set(("match", watch.name, "prefilter"), watch.prefilter.stats())
+
+    def wait_interval(self, now, interval):
+        """不越过规则中最近一个定时条件的到期时刻，避免空闲退避推迟触发"""
+        deadline = self.rules.next_deadline() if self.rules is not None else None
+        if deadline is None:
+            return interval
+        return min(interval, max(0.0, deadline - now))
+
+    def skipped_frames(self):
+        return sum(watch.matcher.skipped for watch in self.engine.watches)
+
+    def poll_state(self, skipped_before):
+        """任一监视项正在累计持续时间时加快轮询，所有监视项画面都未变化时视为空闲"""
+        if any(watch.persistence.match_start_time is not None for watch in self.engine.watches):
+            return URGENT
+        if self.skipped_frames() - skipped_before == len(self.engine.watches):
+            return IDLE
+        return ACTIVE
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
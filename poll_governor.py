@@ -0,0 +1,78 @@
+import time
+
+# 轮询状态：urgent-匹配正在累计持续时间，active-画面有变化，idle-画面未变化
+URGENT = "urgent"
+ACTIVE = "active"
+IDLE = "idle"
+
+
+# 自适应轮询间隔：匹配累计中快速轮询，画面静止时逐步退避，并按本线程实测的 CPU 时间限制占用率
+class PollGovernor:
+    def __init__(self, base_interval=0.1, min_interval=0.02, max_interval=0.5, idle_backoff=1.5, cpu_budget=0.25,
+                 clock=time.monotonic, cpu_clock=time.thread_time):
+        """cpu_budget 为本线程最多占用单个核心的比例（分块并行的工作线程不计入）"""
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_backoff = idle_backoff
+        self.cpu_budget = cpu_budget
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.interval = base_interval
+        self.idle_interval = base_interval
+        self.loop_cpu = 0.0  # 最近一轮的 CPU 时间
+        self.cpu_fraction = 0.0  # 占用率的指数平均
+        self._wall_start = 0.0
+        self._cpu_start = 0.0
+
+    def begin(self):
+        self._wall_start = self.clock()
+        self._cpu_start = self.cpu_clock()
+
+    def end(self, state):
+        """一轮结束时调用，返回下一轮之前应等待的秒数"""
+        busy = self.clock() - self._wall_start
+        self.loop_cpu = self.cpu_clock() - self._cpu_start
+        if state == URGENT:
+            interval = self.min_interval
+            self.idle_interval = self.base_interval
+        elif state == IDLE:
+            self.idle_interval = min(self.max_interval, self.idle_interval * self.idle_backoff)
+            interval = self.idle_interval
+        else:
+            interval = self.base_interval
+            self.idle_interval = self.base_interval
+        # 占用率 = CPU 时间 / (本轮耗时 + 等待时间)，等待时间至少要让占用率不超过预算
+        if self.cpu_budget > 0:
+            interval = max(interval, self.loop_cpu / self.cpu_budget - busy)
+        self.interval = interval
+        self.cpu_fraction = 0.8 * self.cpu_fraction + 0.2 * (self.loop_cpu / max(busy + interval, 1e-9))
+        return interval
+
+
+# 自适应自旋时长：点击迟到超过目标时加长最后阶段的自旋，迟到很小或自旋占用超出预算时缩短
+class SpinGovernor:
+    def __init__(self, spin, min_spin=0.0005, max_spin=0.02, target_lateness=0.0005, cpu_budget=0.05,
+                 cpu_clock=time.thread_time):
+        self.spin = spin
+        self.min_spin = min_spin
+        self.max_spin = max_spin
+        self.target_lateness = target_lateness
+        self.cpu_budget = cpu_budget
+        self.cpu_clock = cpu_clock
+        self.cpu_fraction = 0.0
+        self._cpu_start = cpu_clock()
+        self._last_update = None
+
+    def update(self, lateness, now):
+        """每次按计划点击后调用，返回新的自旋时长"""
+        cpu_now = self.cpu_clock()
+        if self._last_update is not None and now > self._last_update:
+            fraction = (cpu_now - self._cpu_start) / (now - self._last_update)
+            self.cpu_fraction = 0.8 * self.cpu_fraction + 0.2 * fraction
+        self._cpu_start, self._last_update = cpu_now, now
+        if lateness > self.target_lateness and self.cpu_fraction <= self.cpu_budget:
+            self.spin = min(self.max_spin, self.spin * 1.5)
+        elif self.cpu_fraction > self.cpu_budget or lateness < self.target_lateness / 4:
+            self.spin = max(self.min_spin, self.spin / 1.2)
+        return self.spin
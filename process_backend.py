@@ -0,0 +1,205 @@
+import multiprocessing as mp
+import queue
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from multi_matcher import MatchResult, MatchWatch, MultiMatchEngine, plan_capture
+
+# 可跨进程传递的监视项描述，子进程据此重建 MatchWatch
+WatchSpec = namedtuple("WatchSpec", "name template_gray region threshold hold_seconds match_mode")
+WatchSpec.__new__.__defaults__ = (0.9, 5, "auto")
+
+SLOT_COUNT = 2  # 双缓冲：截图进程写一个槽，匹配进程读另一个槽
+RESULT_CAPACITY = 64  # 结果队列最多保留的批数，消费方跟不上时丢弃最旧的
+
+
+def _frame_layout(plan):
+    """计算每个截图分组在共享内存中的偏移，返回 ([(偏移, 高, 宽), ...], 总字节数)"""
+    layout, offset = [], 0
+    for _, (left, top, right, bottom) in plan:
+        height, width = bottom - top, right - left
+        layout.append((offset, height, width))
+        offset += height * width
+    return layout, max(offset, 1)
+
+
+def _slot_views(shm, layout):
+    return [np.ndarray((height, width), dtype=np.uint8, buffer=shm.buf, offset=offset)
+            for offset, height, width in layout]
+
+
+def _put_latest(q, item):
+    """队列满时丢弃最旧的一项再放入，消费方跟不上时内存不会无限增长"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _capture_main(plan, shm_names, task_queues, slot_free, stop_event, poll_interval, capture_factory):
+    """截图进程：每轮把各分组的灰度图写入共享内存槽，再通知所有匹配进程"""
+    from capture import ReplayFinished
+    from frame_pipeline import FramePipeline
+
+    layout, _ = _frame_layout(plan)
+    shms = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    slots = [_slot_views(shm, layout) for shm in shms]
+    pipeline = FramePipeline()
+    workers = len(task_queues)
+    seq = 0
+    try:
+        with capture_factory() as source:
+            while not stop_event.is_set():
+                tick_start = time.monotonic()
+                slot = seq % SLOT_COUNT
+                # 等所有匹配进程都用完这个槽再覆盖
+                for _ in range(workers):
+                    slot_free[slot].acquire()
+                try:
+                    timestamp = source.begin_frame()
+                except ReplayFinished:
+                    break
+                for view, (index, (left, top, right, bottom)) in zip(slots[slot], plan):
+                    frame = source.grab({"left": left, "top": top, "width": right - left, "height": bottom - top})
+                    pipeline.to_gray(frame, out=view)
+                for q in task_queues:
+                    q.put((seq, slot, timestamp))
+                seq += 1
+                stop_event.wait(max(0.0, poll_interval - (time.monotonic() - tick_start)))
+    finally:
+        for q in task_queues:
+            q.put(None)
+        del slots
+        for shm in shms:
+            shm.close()
+
+
+def _worker_main(specs, plan, shm_names, task_queue, result_queue, slot_free):
+    """匹配进程：只在共享内存的灰度图上匹配分到的监视项，只回传结果"""
+    layout, _ = _frame_layout(plan)
+    shms = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    slots = [_slot_views(shm, layout) for shm in shms]
+    engine = MultiMatchEngine([MatchWatch(s.name, s.template_gray, s.region, s.threshold, s.hold_seconds,
+                                          s.match_mode) for s in specs])
+    engine.bind_plan(plan)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            seq, slot, timestamp = task
+            results = []
+            try:
+                for group, gray in zip(engine.groups, slots[slot]):
+                    if group.regions:
+                        engine.match_group(group, gray, timestamp, results)
+            finally:
+                slot_free[slot].release()
+            _put_latest(result_queue, (seq, timestamp, [tuple(r) for r in results]))
+    finally:
+        del slots
+        for shm in shms:
+            shm.close()
+
+
+# 多进程匹配后端：截图和匹配都在子进程中进行，不与 GUI 线程和点击引擎争抢 GIL
+class ProcessMatchBackend:
+    def __init__(self, specs, workers=2, poll_interval=0.1, monitors=None, capture_factory=None,
+                 result_capacity=RESULT_CAPACITY):
+        """capture_factory 在截图子进程中调用，必须可以被 pickle（例如类或 functools.partial）"""
+        self.specs = list(specs)
+        self.workers = max(1, min(workers, len(self.specs)))
+        self.poll_interval = poll_interval
+        self.monitors = monitors
+        if capture_factory is None:
+            from capture import MssCaptureSource
+            capture_factory = MssCaptureSource
+        self.capture_factory = capture_factory
+        self.result_capacity = result_capacity
+        self.processes = []
+        self.shms = []
+        self.ctx = mp.get_context("spawn")
+        self.result_queue = None
+        self.stop_event = None
+        # 信号量和任务队列必须由本对象持有到子进程退出，否则父进程回收后子进程无法重建
+        self.slot_free = []
+        self.task_queues = []
+
+    def _assign(self):
+        """按 区域面积 x 模板面积 估算开销，贪心分配到各匹配进程"""
+        buckets = [[] for _ in range(self.workers)]
+        loads = [0] * self.workers
+        for spec in sorted(self.specs, key=self._cost, reverse=True):
+            i = loads.index(min(loads))
+            buckets[i].append(spec)
+            loads[i] += self._cost(spec)
+        return buckets
+
+    @staticmethod
+    def _cost(spec):
+        x1, y1, x2, y2 = spec.region
+        th, tw = spec.template_gray.shape[:2]
+        return (x2 - x1) * (y2 - y1) * th * tw
+
+    def start(self):
+        monitors = self.monitors
+        if monitors is None:
+            with self.capture_factory() as source:
+                monitors = source.monitors
+        plan = plan_capture(monitors, [s.region for s in self.specs])
+        _, size = _frame_layout(plan)
+        self.shms = [shared_memory.SharedMemory(create=True, size=size) for _ in range(SLOT_COUNT)]
+        shm_names = [shm.name for shm in self.shms]
+
+        ctx = self.ctx
+        self.stop_event = ctx.Event()
+        self.result_queue = ctx.Queue(self.result_capacity)
+        self.slot_free = [ctx.Semaphore(self.workers) for _ in range(SLOT_COUNT)]
+        self.task_queues = []
+        for specs in self._assign():
+            task_queue = ctx.Queue()
+            self.task_queues.append(task_queue)
+            self.processes.append(ctx.Process(
+                target=_worker_main, args=(specs, plan, shm_names, task_queue, self.result_queue, self.slot_free),
+                daemon=True))
+        self.processes.append(ctx.Process(
+            target=_capture_main, args=(plan, shm_names, self.task_queues, self.slot_free, self.stop_event,
+                                        self.poll_interval, self.capture_factory), daemon=True))
+        for process in self.processes:
+            process.start()
+
+    def get_results(self, timeout=None):
+        """取一批结果，返回 (截图时间戳, [MatchResult, ...])；超时返回 None"""
+        try:
+            _, timestamp, results = self.result_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return timestamp, [MatchResult(*r) for r in results]
+
+    def stop(self, timeout=2.0):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        # 子进程都已退出，释放队列和信号量
+        for q in self.task_queues + ([self.result_queue] if self.result_queue is not None else []):
+            q.close()
+            q.cancel_join_thread()
+        self.task_queues = []
+        self.result_queue = None
+        self.slot_free = []
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
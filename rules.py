@@ -0,0 +1,261 @@
+import heapq
+
+from click_scheduler import compile_schedule
+
+# 声明式触发规则：由配置文件描述"条件 -> 动作"，编译成按输入索引的状态机，
+# 每帧只处理状态发生变化的输入和到期的定时条件，规则数量增加时每帧开销基本不变。
+#
+# 配置示例（与 headless.py 的配置放在同一个文件中）：
+# {
+#     "schedules": {"fast": [2, 3], "normal": [9, 10]},
+#     "rules": [
+#         {"name": "btn-5s", "when": {"seen": "btn", "for": 5}, "repeat": true,
+#          "do": [{"click": "main"}, {"schedule": "normal", "target": "main"}]},
+#         {"name": "btn-gone", "when": {"absent": "btn", "for": 30}, "do": [{"pause": "main"}]},
+#         {"name": "btn-back", "when": {"seen": "btn"}, "do": [{"resume": "main"}]},
+#         {"name": "bar-rising", "when": [{"rising": "bar", "steps": 3, "min_delta": 0.05}, {"seen": "btn"}],
+#          "do": [{"click": [640, 360]}]}
+#     ]
+# }
+#
+# 条件：seen / absent 为监视项连续匹配 / 连续未匹配至少 for 秒（默认 0）；
+#       rising 为匹配得分最近 steps 次变化都在上升且累计至少 min_delta。
+# when 为列表时所有条件同时成立才触发。规则只在条件由假变真时触发一次；
+# repeat 为 true 时触发后重新开始计时，条件一直成立则每隔 for 秒再触发。
+# 动作：click 为目标id（立即点击该目标）或坐标 [x, y]；schedule 为命名时间节点或列表，
+#       需指定 target，可选 keep_phase；pause / resume 为目标id。
+
+
+# 一个监视项的输入状态，以及订阅它的条件
+class InputState:
+    def __init__(self, name):
+        self.name = name
+        self.matched = None  # 第一帧之前未知，第一帧一定视为变化
+        self.score = None
+        self.matched_conditions = []
+        self.score_conditions = []
+
+
+# seen / absent 的公共部分：输入进入所需状态后经过 hold 秒条件为真
+class HoldCondition:
+    want = True
+
+    def __init__(self, input_name, hold=0.0):
+        self.input = input_name
+        self.hold = float(hold)
+        self.value = False
+        self.generation = 0  # 每次重新计时加一，定时堆中的旧条目据此作废
+        self.rule = None
+
+    def on_matched(self, engine, matched, now):
+        """输入的匹配状态变化时调用，返回条件的真假是否改变"""
+        if matched == self.want:
+            return self.arm(engine, now)
+        self.generation += 1
+        return self._set(False)
+
+    def arm(self, engine, since):
+        self.generation += 1
+        if self.hold <= 0:
+            return self._set(True)
+        engine.schedule(since + self.hold, self)
+        return self._set(False)
+
+    def on_deadline(self, engine, now):
+        return self._set(True)
+
+    def _set(self, value):
+        changed = value != self.value
+        self.value = value
+        return changed
+
+
+class SeenCondition(HoldCondition):
+    want = True
+
+
+class AbsentCondition(HoldCondition):
+    want = False
+
+
+# 得分上升：只在得分变化时更新（画面未变化时得分不变，规则被跳过）
+class RisingCondition:
+    def __init__(self, input_name, steps=3, min_delta=0.05):
+        if steps < 1:
+            raise ValueError(f"rising 条件的 steps 至少为 1: {steps}")
+        self.input = input_name
+        self.steps = steps
+        self.min_delta = min_delta
+        self.scores = []  # 最近 steps + 1 个不同的得分
+        self.value = False
+        self.rule = None
+
+    def on_score(self, score):
+        scores = self.scores
+        scores.append(score)
+        if len(scores) > self.steps + 1:
+            del scores[0]
+        value = (len(scores) == self.steps + 1 and scores[-1] - scores[0] >= self.min_delta
+                 and all(a < b for a, b in zip(scores, scores[1:])))
+        changed = value != self.value
+        self.value = value
+        return changed
+
+
+# 一条规则：条件全部成立的上升沿执行动作
+class Rule:
+    def __init__(self, index, name, conditions, actions, repeat=False):
+        self.index = index
+        self.name = name
+        self.conditions = conditions
+        self.actions = actions
+        self.repeat = repeat
+        self.value = False
+        self.fired = 0
+        self.last_fired = None
+        for condition in conditions:
+            condition.rule = self
+
+    def update(self, engine, now):
+        value = all(c.value for c in self.conditions)
+        if value and not self.value:
+            self.fired += 1
+            self.last_fired = now
+            for action in self.actions:
+                action(now)
+            if self.repeat:
+                # 持续条件重新计时，条件一直成立时每隔 for 秒再次触发
+                for condition in self.conditions:
+                    if isinstance(condition, HoldCondition) and condition.hold > 0:
+                        condition.arm(engine, now)
+                value = all(c.value for c in self.conditions)
+        self.value = value
+
+
+# 规则引擎：在检测线程中每帧调用一次 evaluate，动作通过点击运行器的线程安全接口执行
+class RuleEngine:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.inputs = {}  # 监视项名称 -> InputState，只包含被规则引用的监视项
+        self.heap = []  # (截止时间, 序号, 条件, generation)
+        self._seq = 0
+        for rule in self.rules:
+            for condition in rule.conditions:
+                state = self.inputs.get(condition.input)
+                if state is None:
+                    state = self.inputs[condition.input] = InputState(condition.input)
+                if isinstance(condition, RisingCondition):
+                    state.score_conditions.append(condition)
+                else:
+                    state.matched_conditions.append(condition)
+
+    def schedule(self, deadline, condition):
+        self._seq += 1
+        heapq.heappush(self.heap, (deadline, self._seq, condition, condition.generation))
+
+    def next_deadline(self):
+        """最近一个定时条件的到期时刻，没有时返回 None（检测循环据此限制轮询间隔）"""
+        heap = self.heap
+        while heap and heap[0][3] != heap[0][2].generation:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def evaluate(self, now, results):
+        """results 为本帧的 MatchResult 列表，返回本帧触发的规则列表"""
+        touched = set()
+        inputs = self.inputs
+        for result in results:
+            state = inputs.get(result.name)
+            if state is None:
+                continue
+            if result.matched != state.matched:
+                state.matched = result.matched
+                for condition in state.matched_conditions:
+                    if condition.on_matched(self, result.matched, now):
+                        touched.add(condition.rule)
+            if result.score != state.score:
+                state.score = result.score
+                for condition in state.score_conditions:
+                    if condition.on_score(result.score):
+                        touched.add(condition.rule)
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            _, _, condition, generation = heapq.heappop(heap)
+            if generation == condition.generation and condition.on_deadline(self, now):
+                touched.add(condition.rule)
+        if not touched:
+            return []
+        fired = []
+        for rule in sorted(touched, key=lambda r: r.index):
+            count = rule.fired
+            rule.update(self, now)
+            if rule.fired != count:
+                fired.append(rule)
+        return fired
+
+    def stats(self):
+        return {rule.name: rule.fired for rule in self.rules}
+
+
+def _compile_condition(item, watch_names):
+    for kind, cls in (("seen", SeenCondition), ("absent", AbsentCondition)):
+        if kind in item:
+            condition = cls(item[kind], item.get("for", 0.0))
+            break
+    else:
+        if "rising" not in item:
+            raise ValueError(f"未知的规则条件: {item}")
+        condition = RisingCondition(item["rising"], int(item.get("steps", 3)), float(item.get("min_delta", 0.05)))
+    if condition.input not in watch_names:
+        raise ValueError(f"规则条件引用了不存在的检测项: {condition.input}")
+    return condition
+
+
+def _compile_action(item, click_runner, target_ids, schedules):
+    def require_target(target_id):
+        if target_id not in target_ids:
+            raise ValueError(f"规则动作引用了不存在的点击目标: {target_id}")
+        return target_id
+
+    if "click" in item:
+        if isinstance(item["click"], (list, tuple)):
+            pos = (int(item["click"][0]), int(item["click"][1]))
+            return lambda now: click_runner.click_at(pos, now)
+        target_id = require_target(item["click"])
+        return lambda now: click_runner.trigger(target_id, now)
+    if "schedule" in item:
+        target_id = require_target(item.get("target"))
+        pattern = item["schedule"]
+        if isinstance(pattern, str):
+            if pattern not in schedules:
+                raise ValueError(f"规则动作引用了不存在的时间节点: {pattern}")
+            pattern = schedules[pattern]
+        schedule = compile_schedule(pattern)
+        keep_phase = bool(item.get("keep_phase", False))
+        return lambda now: click_runner.reschedule(target_id, schedule, keep_phase)
+    for kind, enabled in (("pause", False), ("resume", True)):
+        if kind in item:
+            target_id = require_target(item[kind])
+            return lambda now: click_runner.set_enabled(target_id, enabled)
+    raise ValueError(f"未知的规则动作: {item}")
+
+
+def build_rules(config, click_runner):
+    """按配置编译规则，没有规则时返回 None；配置无效时抛出 ValueError"""
+    items = config.get("rules") or []
+    if not items:
+        return None
+    if click_runner is None:
+        raise ValueError("规则需要点击运行器")
+    watch_names = {item["name"] for item in config.get("watches", [])}
+    target_ids = {item["id"] for item in config.get("clicks", [])}
+    schedules = {name: compile_schedule(pattern) for name, pattern in (config.get("schedules") or {}).items()}
+    rules = []
+    for index, item in enumerate(items):
+        when = item.get("when")
+        if not when:
+            raise ValueError(f"规则 {item.get('name', index)} 没有设置条件")
+        conditions = [_compile_condition(c, watch_names) for c in (when if isinstance(when, list) else [when])]
+        actions = [_compile_action(a, click_runner, target_ids, schedules) for a in item.get("do", [])]
+        rules.append(Rule(index, item.get("name", f"rule{index}"), conditions, actions, bool(item.get("repeat"))))
+    return RuleEngine(rules)
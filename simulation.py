@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from capture import SyntheticCaptureSource
+
+# 模拟与浸泡测试：
+#   simulate  用虚拟时钟驱动真实的检测和点击运行器，不按真实时间等待地跑完数天的定时点击和脚本化的匹配事件，
+#             检查点击次数、漂移和触发次数
+#   soak      用真实线程长时间运行无界面配置，定期采样内存、线程数和句柄数，检查资源泄漏
+#
+# simulate 的配置与 headless.py 相同，监视项用 script 代替模板和截图（在合成画面上按时间窗口显示内置模板）：
+# {
+#     "clicks": [{"id": "main", "pos": [800, 600], "intervals": [9, 10]}],
+#     "watches": [{"name": "btn", "hold_seconds": 5, "on_persistent": {"click": "main", "reset": [9, 10]},
+#                  "script": {"windows": [[100, 110]], "repeat": 3600}}],
+#     "poll_interval": 0.1
+# }
+# 配置中的 rules / schedules（见 rules.py）同样按虚拟时间求值
+
+
+# 监视项的可见时间窗口：窗口内模板出现在画面上，repeat 不为空时窗口按周期重复
+class ScriptWindows:
+    def __init__(self, windows, repeat=None):
+        self.windows = sorted((float(start), float(end)) for start, end in windows)
+        self.repeat = repeat
+
+    def _local(self, t):
+        if self.repeat:
+            cycle = t // self.repeat
+            return cycle * self.repeat, t - cycle * self.repeat
+        return 0.0, t
+
+    def visible(self, t):
+        _, local = self._local(t)
+        return any(start <= local < end for start, end in self.windows)
+
+    def next_change(self, t):
+        """t 之后下一次出现或消失的时刻，没有时返回 None"""
+        base, local = self._local(t)
+        edges = [edge for window in self.windows for edge in window if edge > local]
+        if edges:
+            return base + min(edges)
+        if self.repeat and self.windows:
+            return base + self.repeat + self.windows[0][0]
+        return None
+
+
+# 按脚本绘制的合成画面：每个监视项占一个格子，可见窗口内把模板画在格子中间
+class ScriptedCaptureSource(SyntheticCaptureSource):
+    CELL = 48
+
+    def __init__(self, scripts, template_gray, clock):
+        super().__init__(self.CELL * max(len(scripts), 1), self.CELL, template_gray, realtime=True, clock=clock)
+        offset = (self.CELL - template_gray.shape[1]) // 2
+        self.scripts = [(script, index * self.CELL + offset, offset) for index, script in enumerate(scripts)]
+
+    @classmethod
+    def region(cls, index):
+        return (index * cls.CELL, 0, (index + 1) * cls.CELL, cls.CELL)
+
+    def visible(self, elapsed=None):
+        elapsed = self.elapsed if elapsed is None else elapsed
+        return [(x, y) for script, x, y in self.scripts if script.visible(elapsed)]
+
+    def next_change(self, now):
+        """下一次画面内容变化的时钟时刻，没有时返回 None"""
+        start = self.start_time if self.start_time is not None else self.clock()
+        changes = [t for t in (script.next_change(now - start) for script, _, _ in self.scripts) if t is not None]
+        return start + min(changes) if changes else None
+
+
+def script_template(side=24, seed=1):
+    # 有明显结构的模板，避免与噪声背景偶然相关
+    rng = np.random.default_rng(seed)
+    template = cv2.resize(rng.integers(0, 256, (8, 8), dtype=np.uint8), (side, side),
+                          interpolation=cv2.INTER_NEAREST)
+    cv2.rectangle(template, (1, 1), (side - 2, side - 2), 255, 2)
+    return template
+
+
+def simulate(config, duration, poll_interval=None):
+    """在虚拟时间里运行 duration 秒，返回统计结果。
+    检测和点击都由真实的 MultiMatchRunner / MultiTargetRunner 完成，时间全部取自虚拟时钟"""
+    from clocks import VirtualClock
+    from headless import build_click_runner, build_match_runner
+    from input_backend import RecordingInputBackend
+    from multi_matcher import MatchWatch
+
+    if poll_interval is not None:
+        config = dict(config, poll_interval=poll_interval)
+    clock = VirtualClock()
+    backend = RecordingInputBackend(clock=clock, max_events=0)  # 点击次数由各目标自己统计，不保存事件
+    click_runner = (build_click_runner(config, clock=clock, backend=backend)
+                    if config["clicks"] or config.get("rules") else None)
+    template = script_template()
+    scripts, watches = [], []
+    for index, item in enumerate(config["watches"]):
+        script = item.get("script", {})
+        scripts.append(ScriptWindows(script.get("windows", []), script.get("repeat")))
+        watches.append(MatchWatch(item["name"], template, ScriptedCaptureSource.region(index),
+                                  item.get("threshold", 0.9), item.get("hold_seconds", 5), item.get("mode", "auto"),
+                                  prefilter=item.get("prefilter")))
+    source = ScriptedCaptureSource(scripts, template, clock)
+    runner = build_match_runner(config, click_runner, watches=watches, capture_factory=lambda: source, clock=clock)
+
+    # 记录每次持续匹配的时刻；没有配置反应的监视项只计数，不打印
+    triggers = {item["name"]: [] for item in config["watches"]}
+    reacting = {item["name"] for item in config["watches"] if item.get("on_persistent")}
+    react = runner.on_persistent
+
+    def on_persistent(result, detected_at):
+        triggers[result.name].append(detected_at)
+        if result.name in reacting:
+            react(result, detected_at)
+    runner.on_persistent = on_persistent
+
+    started = time.perf_counter()
+    if click_runner is not None:
+        click_runner.begin()
+    polls = 0
+    next_poll = 0.0 if watches else None
+    with runner.open_source() as source:
+        while True:
+            deadline = click_runner.timers.next_deadline() if click_runner is not None else None
+            candidates = [t for t in (deadline, next_poll) if t is not None]
+            if not candidates or min(candidates) > duration:
+                break
+            clock.advance_to(min(candidates))
+            if next_poll is not None and clock() >= next_poll:
+                polls += 1
+                now = clock()
+                next_poll = now + runner.step(source)
+                if not source.visible() and not any(watch.persistence.match_start_time is not None
+                                                    for watch in watches):
+                    # 画面上没有模板、也没有监视项在累计持续时间时，下一次变化前的轮询只会得到相同结果，
+                    # 直接跳到画面变化或规则定时条件到期的时刻
+                    change = source.next_change(now)
+                    skip_to = min(change if change is not None else float("inf"),
+                                  now + runner.wait_interval(now, float("inf")))
+                    if skip_to != float("inf"):
+                        next_poll = max(next_poll, skip_to)
+            if click_runner is not None:
+                while click_runner.service():
+                    pass
+
+    result = {"virtual_seconds": duration, "wall_seconds": round(time.perf_counter() - started, 3),
+              "polls": polls, "clicks": {}, "watches": {}}
+    if click_runner is not None:
+        for target in click_runner.timers.targets.values():
+            stats = target.scheduler.lateness_stats()
+            result["clicks"][str(target.target_id)] = {
+                "count": target.click_counter,
+                "skipped": target.scheduler.skipped,
+                "max_lateness": stats["max"],
+                "next_deadline": target.scheduler.next_deadline,
+            }
+    if runner.rules is not None:
+        result["rules"] = runner.rules.stats()
+    for name, times in triggers.items():
+        result["watches"][name] = {"triggers": len(times), "first": times[0] if times else None,
+                                   "last": times[-1] if times else None}
+    return result
+
+
+def resource_usage():
+    """返回 (常驻内存字节数, 线程数, 句柄/文件描述符数)，无法获取的项为 None"""
+    try:
+        import psutil
+        process = psutil.Process()
+        handles = process.num_handles() if sys.platform == "win32" else process.num_fds()
+        return process.memory_info().rss, process.num_threads(), handles
+    except ImportError:
+        pass
+    rss = threads = handles = None
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+        handles = len(os.listdir("/proc/self/fd"))
+    if threads is None:
+        threads = threading.active_count()
+    return rss, threads, handles
+
+
+def _slope_per_hour(samples, index):
+    points = [(s[0], s[index]) for s in samples if s[index] is not None]
+    if len(points) < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var * 3600
+
+
+def soak(config, duration, sample_interval=60.0):
+    """用真实线程运行配置 duration 秒，定期采样资源占用，返回样本和增长趋势"""
+    from headless import run
+
+    samples = []
+    started = time.monotonic()
+    next_sample = [started]
+
+    def sample():
+        # 只在引擎线程运行期间采样，启动和退出时的线程数变化不算泄漏
+        now = time.monotonic()
+        if now >= next_sample[0] or now - started >= duration - 0.5:
+            samples.append((now - started,) + resource_usage())
+            next_sample[0] = now + sample_interval
+
+    config = dict(config, duration=duration)
+    run(config, on_wait=sample)
+    if not samples:
+        return {"seconds": 0, "samples": [], "rss_growth": None, "rss_slope_per_hour": 0.0,
+                "thread_growth": None, "handle_growth": None}
+    first, last = samples[0], samples[-1]
+    return {
+        "seconds": round(last[0], 1),
+        "samples": [{"t": round(t, 1), "rss": rss, "threads": threads, "handles": handles}
+                    for t, rss, threads, handles in samples],
+        "rss_growth": (last[1] - first[1]) if first[1] is not None and last[1] is not None else None,
+        "rss_slope_per_hour": _slope_per_hour(samples, 1),
+        "thread_growth": (last[2] - first[2]) if first[2] is not None and last[2] is not None else None,
+        "handle_growth": (last[3] - first[3]) if first[3] is not None and last[3] is not None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="虚拟时钟模拟与长时间浸泡测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sim = sub.add_parser("simulate", help="用虚拟时钟快速模拟长时间运行")
+    sim.add_argument("config", help="JSON 配置文件路径")
+    sim.add_argument("--days", type=float, default=1.0, help="模拟的天数")
+    sim.add_argument("--poll-interval", type=float, help="检测轮询间隔，覆盖配置")
+    sim.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    soak_parser = sub.add_parser("soak", help="用真实线程长时间运行并采样资源占用")
+    soak_parser.add_argument("config", help="JSON 配置文件路径（建议使用 synthetic 截图和 recording 输入）")
+    soak_parser.add_argument("--hours", type=float, default=1.0, help="运行小时数")
+    soak_parser.add_argument("--sample-interval", type=float, default=60.0, help="采样间隔（秒）")
+    soak_parser.add_argument("--max-rss-growth-mb", type=float, default=50.0, help="允许的内存增长（MB）")
+    soak_parser.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    from headless import load_config
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 2
+
+    status = 0
+    if args.command == "simulate":
+        result = simulate(config, args.days * 86400, args.poll_interval)
+    else:
+        result = soak(config, args.hours * 3600, args.sample_interval)
+        leaks = []
+        if result["rss_growth"] is not None and result["rss_growth"] > args.max_rss_growth_mb * 1024 * 1024:
+            leaks.append(f"内存增长 {result['rss_growth'] / 1024 / 1024:.1f}MB")
+        if result["thread_growth"]:
+            leaks.append(f"线程数增长 {result['thread_growth']}")
+        if result["handle_growth"]:
+            leaks.append(f"句柄数增长 {result['handle_growth']}")
+        for line in leaks:
+            print(f"可能的资源泄漏: {line}", file=sys.stderr)
+        status = 1 if leaks else 0
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import threading
+
+
+# 遥测状态表：引擎线程只写入原始值（不格式化），界面按固定刷新率拉取发生变化的字段
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.versions = {}  # 字段 -> 最近一次变化时的版本号
+        self.version = 0
+
+    def set(self, field, value):
+        """值未变化时不产生任何更新"""
+        if self.values.get(field, self) == value:
+            return
+        with self.lock:
+            self.version += 1
+            self.values[field] = value
+            self.versions[field] = self.version
+
+    def get(self, field, default=None):
+        return self.values.get(field, default)
+
+    def changes(self, since):
+        """返回 (当前版本号, {字段: 值})，只包含 since 之后变化过的字段"""
+        with self.lock:
+            if self.version == since:
+                return since, {}
+            changed = {f: self.values[f] for f, v in self.versions.items() if v > since}
+            return self.version, changed
+
+
+def format_elapsed(seconds):
+    seconds = max(0, int(seconds))
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+# 界面侧的渲染缓存：只有格式化后的文本确实变化时才调用 setter
+class RenderCache:
+    def __init__(self):
+        self.rendered = {}
+
+    def update(self, key, text, setter):
+        if self.rendered.get(key) != text:
+            self.rendered[key] = text
+            setter(text)
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from matching import build_pyramid, pyramid_levels, shrink
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".autoplay", "template_cache")
+STORE_VERSION = 3  # 派生数据的格式或算法变化时加一，旧条目自动失效
+STAT_SCALES = (1, 2, 4, 8)  # 保存均值/标准差的缩小倍数（1 为原模板，其余对应预筛选的缩小模板）
+DERIVED_CAPACITY = 4  # 每个模板最多保留的可选派生数据数（每种帧尺寸一个 FFT 频谱），按最近使用淘汰
+
+
+# 缓存中的一张模板：灰度图和派生数据均为只读内存映射数组；
+# path 为 None 时（缓存目录不可用）只在内存中保存已解码的 gray 和派生数据
+class CachedTemplate:
+    def __init__(self, store, key, path, gray=None):
+        self.store = store
+        self.key = key
+        self.path = path
+        if path is None:
+            self.gray = gray
+            self.pyramid = build_pyramid(gray, pyramid_levels(gray))
+            self.stats = template_stats(gray)
+        else:
+            self.gray = self._load("gray")
+            self.pyramid = [self.gray] + [self._load(f"pyramid_{level}")
+                                          for level in range(1, pyramid_levels(self.gray) + 1)]
+            self.stats = self._load("stats")
+        self._derived = OrderedDict()
+
+    def mean_std(self, scale=1):
+        """模板按 scale 缩小后的 (均值, 标准差)，FFT 匹配和方差预筛选直接使用"""
+        if scale in STAT_SCALES:
+            mean, std = self.stats[STAT_SCALES.index(scale)]
+            return float(mean), float(std)
+        mean, std = cv2.meanStdDev(shrink(self.gray, scale))
+        return float(mean[0, 0]), float(std[0, 0])
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def derived(self, name):
+        """读取可选的派生数据（例如 FFT 频谱），不存在时返回 None"""
+        array = self._derived.get(name)
+        if array is None and self.path is not None:
+            try:
+                array = self._load(f"derived_{name}")
+                os.utime(os.path.join(self.path, f"derived_{name}.npy"))  # 修改时间作为最近使用时间
+            except (OSError, ValueError):
+                return None
+        if array is not None:
+            self._remember(name, array)
+        return array
+
+    def put_derived(self, name, array):
+        """保存可选的派生数据，下次启动直接映射读取；条目已被淘汰时只保留在内存中"""
+        if self.path is not None:
+            try:
+                _save(self.path, f"derived_{name}", array)
+                array = self._load(f"derived_{name}")
+                self._prune_derived()
+            except OSError:
+                pass
+        self._remember(name, array)
+        return array
+
+    def _remember(self, name, array):
+        self._derived[name] = array
+        self._derived.move_to_end(name)
+        while len(self._derived) > DERIVED_CAPACITY:
+            self._derived.popitem(last=False)
+
+    def _prune_derived(self):
+        """磁盘上的派生数据超过 DERIVED_CAPACITY 时删除最久未使用的"""
+        files = [n for n in os.listdir(self.path) if n.startswith("derived_") and ".tmp" not in n]
+        if len(files) <= DERIVED_CAPACITY:
+            return
+        files.sort(key=lambda n: os.path.getmtime(os.path.join(self.path, n)))
+        for name in files[:len(files) - DERIVED_CAPACITY]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass  # 其他进程仍在映射读取时无法删除，下次再试
+
+
+def template_stats(template_gray):
+    """STAT_SCALES 各缩小倍数下模板的 (均值, 标准差)，缩小后小于 1 像素时沿用上一行"""
+    stats = np.zeros((len(STAT_SCALES), 2), dtype=np.float64)
+    for i, scale in enumerate(STAT_SCALES):
+        if min(template_gray.shape[:2]) < scale:
+            stats[i] = stats[i - 1]
+            continue
+        mean, std = cv2.meanStdDev(shrink(template_gray, scale))
+        stats[i] = mean[0, 0], std[0, 0]
+    return stats
+
+
+def _save(directory, name, array):
+    tmp = os.path.join(directory, f"{name}.tmp.npy")
+    np.save(tmp, np.ascontiguousarray(array))
+    os.replace(tmp, os.path.join(directory, f"{name}.npy"))
+
+
+# 模板库缓存：按图片文件内容哈希保存灰度模板及金字塔、均值/标准差等派生数据，
+# 再次加载时跳过图片解码和预处理；磁盘和内存中都按最近使用淘汰。
+# 缓存目录无法创建或写入时退化为直接解码，模板只保留在内存中
+class TemplateStore:
+    def __init__(self, root=DEFAULT_ROOT, capacity=512, memory_capacity=64):
+        self.root = root
+        self.capacity = capacity  # 磁盘上最多保留的条目数
+        self.memory_capacity = memory_capacity  # 内存中最多保留的已映射条目数
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.error = None  # 缓存目录不可用的原因
+        try:
+            os.makedirs(root, exist_ok=True)
+        except OSError as e:
+            self.error = str(e)
+
+    @staticmethod
+    def content_key(data):
+        return f"v{STORE_VERSION}-{hashlib.sha1(data).hexdigest()}"
+
+    def load(self, path):
+        """读取模板图片，返回 CachedTemplate；图片无法解码时抛出 ValueError"""
+        with open(path, "rb") as f:
+            data = f.read()
+        key = self.content_key(data)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        template = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if template is None:
+            raise ValueError(f"模板图片加载失败: {path}")
+        return self._create(key, cv2.cvtColor(template, cv2.COLOR_BGR2GRAY))
+
+    def add(self, template_gray):
+        """直接缓存一张灰度模板（例如截图得到的模板）"""
+        template_gray = np.ascontiguousarray(template_gray)
+        key = self.content_key(np.array(template_gray.shape, dtype=np.int64).tobytes() + template_gray.tobytes())
+        entry = self.get(key)
+        return entry if entry is not None else self._create(key, template_gray)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        path = os.path.join(self.root, key)
+        if self.error is not None or not os.path.isdir(path):
+            return None
+        try:
+            entry = CachedTemplate(self, key, path)
+        except (OSError, ValueError):
+            # 条目损坏（例如写入中途被中断），删除后按未命中处理
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.utime(path)  # 目录修改时间作为最近使用时间
+        self.hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def _create(self, key, template_gray):
+        self.misses += 1
+        try:
+            entry = self._write(key, template_gray)
+        except OSError:
+            entry = CachedTemplate(self, key, None, template_gray)
+        self._remember(key, entry)
+        return entry
+
+    def _write(self, key, template_gray):
+        if self.error is not None:
+            raise OSError(self.error)
+        path = os.path.join(self.root, key)
+        tmp = f"{path}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            _save(tmp, "gray", template_gray)
+            pyramid = build_pyramid(template_gray, pyramid_levels(template_gray))
+            for level in range(1, len(pyramid)):
+                _save(tmp, f"pyramid_{level}", pyramid[level])
+            _save(tmp, "stats", template_stats(template_gray))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # 其他进程已写入同一条目，内容相同，直接使用已有的
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+        return CachedTemplate(self, key, path)
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.memory_capacity:
+            self.entries.popitem(last=False)
+
+    def evict(self):
+        """磁盘条目超过 capacity 时删除最久未使用的条目"""
+        try:
+            names = [n for n in os.listdir(self.root) if n.startswith("v") and ".tmp" not in n]
+        except OSError:
+            return
+        if len(names) <= self.capacity:
+            return
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(self.root, n)))
+        for name in names[:len(names) - self.capacity]:
+            self.entries.pop(name, None)
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "loaded": len(self.entries), "error": self.error}
+
+
+_default_store = None
+
+
+def get_default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = TemplateStore()
+    return _default_store
+
@@ -1,7 +1,7 @@
+import os
 import sys
 import time
 import pyautogui
-import ctypes
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QMutex
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLabel, QLineEdit, QListWidget,
@@ -10,11 +10,9 @@ from PyQt5.QtGui import QFont
 from pynput import keyboard
 
 
-# 高性能点击函数（Windows系统专用）
-def precise_click(x, y):
-    ctypes.windll.user32.SetCursorPos(x, y)
-    ctypes.windll.user32.mouse_event(0x0002, 0, 0, 0, 0)  # 按下左键
-    ctypes.windll.user32.mouse_event(0x0004, 0, 0, 0, 0)  # 释放左键
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from click_scheduler import DeadlineScheduler, compile_schedule
+from input_backend import precise_click  # 与 auto_play.py 共用输入后端
 
 
 class GlobalHotkeyListener(QThread):
@@ -55,42 +53,50 @@ class PrecisionClickEngine(QThread):
         super().__init__()
         self.running = False
         self.click_pos = click_pos
-        self.interval_pattern = interval_pattern  # 使用传入的点击间隔模式
-        self.current_index = 0
-        self.next_click_time = 0
+        # 引擎只持有编译后的不可变时间表，界面增删改自己的列表不会影响正在迭代的引擎
+        self.requested_schedule = compile_schedule(interval_pattern) if interval_pattern else None
+        self.scheduler = None
         self.start_timestamp = 0
         self.click_counter = 0
 
+    def swap_schedule(self, interval_pattern):
+        """可在界面线程调用：编译后整体替换引用，引擎在下一轮保持相位切换到新时间节点"""
+        self.requested_schedule = compile_schedule(interval_pattern)
+
     def run(self):
-        if not self.interval_pattern:
+        if self.requested_schedule is None:
             self.status_update.emit("错误: 没有设置时间节点")
             self.operation_completed.emit()
             return
 
         self.running = True
-        self.start_timestamp = time.time()
-        self.next_click_time = self.start_timestamp + self.interval_pattern[0]
-        self.current_index = 0
+        self.scheduler = DeadlineScheduler(self.requested_schedule)
+        self.scheduler.start()
+        self.start_timestamp = self.scheduler.start_time
         self.click_counter = 0
 
         try:
             while self.running:
-                current_time = time.time()
+                # 只读一次引用，替换是原子的，不会看到改了一半的时间节点
+                schedule = self.requested_schedule
+                if schedule is not self.scheduler.schedule:
+                    self.scheduler.swap(schedule, keep_phase=True)
+
+                current_time = self.scheduler.clock()
 
-                # 更新时间显示（每秒更新一次）
-                if int(current_time) > int(current_time - 1):
-                    elapsed = int(current_time - self.start_timestamp)
-                    self.time_update.emit(
-                        f"{elapsed // 3600:02d}:{(elapsed % 3600) // 60:02d}:{elapsed % 60:02d}"
-                    )
+                # 更新时间显示
+                elapsed = int(current_time - self.start_timestamp)
+                self.time_update.emit(
+                    f"{elapsed // 3600:02d}:{(elapsed % 3600) // 60:02d}:{elapsed % 60:02d}"
+                )
 
                 # 执行点击的条件判断
-                if current_time >= self.next_click_time:
+                if self.scheduler.due(current_time):
                     self.execute_click()
-                    self.schedule_next_click(current_time)
+                    self.scheduler.complete(self.scheduler.clock())
 
                 # 智能休眠机制
-                sleep_time = self.calculate_sleep_time(current_time)
+                sleep_time = self.calculate_sleep_time(self.scheduler.clock())
                 time.sleep(sleep_time)
 
         except Exception as e:
@@ -103,23 +109,15 @@ class PrecisionClickEngine(QThread):
             precise_click(*self.click_pos)
             self.click_counter += 1
             self.click_count_update.emit(self.click_counter)
-            current_interval = self.interval_pattern[self.current_index % len(self.interval_pattern)]
             self.status_update.emit(
                 f"成功点击 ({self.click_pos[0]}, {self.click_pos[1]})\n"
-                f"下次点击间隔: {current_interval}秒"
+                f"下次点击间隔: {self.scheduler.current_interval}秒"
             )
         except Exception as e:
             self.status_update.emit(f"点击失败: {str(e)}")
 
-    def schedule_next_click(self, current_time):
-        self.current_index += 1
-        if self.current_index >= len(self.interval_pattern):
-            self.current_index = 0  # 循环模式
-        next_interval = self.interval_pattern[self.current_index]
-        self.next_click_time = current_time + next_interval
-
     def calculate_sleep_time(self, current_time):
-        remaining = self.next_click_time - current_time
+        remaining = self.scheduler.next_deadline - current_time
         if remaining > 1:
             return 0.1  # 长间隔时低频检查
         elif remaining > 0.1:
@@ -282,7 +280,7 @@ class AutoClickerWindow(QWidget):
         if ok:
             self.interval_pattern.append(interval)
             self.update_interval_list()
-            self.status_display.setText(f"已添加时间节点: {interval}秒")
+            self.status_display.setText(f"已添加时间节点: {interval}秒" + self.push_schedule())
 
     def edit_interval(self):
         if not self.interval_list.currentItem():
@@ -299,7 +297,7 @@ class AutoClickerWindow(QWidget):
         if ok:
             self.interval_pattern[row] = interval
             self.update_interval_list()
-            self.status_display.setText(f"已更新时间节点: {old_value}秒 → {interval}秒")
+            self.status_display.setText(f"已更新时间节点: {old_value}秒 → {interval}秒" + self.push_schedule())
 
     def remove_interval(self):
         if not self.interval_list.currentItem():
@@ -309,7 +307,7 @@ class AutoClickerWindow(QWidget):
         row = self.interval_list.currentRow()
         removed = self.interval_pattern.pop(row)
         self.update_interval_list()
-        self.status_display.setText(f"已删除时间节点: {removed}秒")
+        self.status_display.setText(f"已删除时间节点: {removed}秒" + self.push_schedule())
 
     def clear_intervals(self):
         if not self.interval_pattern:
@@ -323,7 +321,16 @@ class AutoClickerWindow(QWidget):
         if reply == QMessageBox.Yes:
             self.interval_pattern.clear()
             self.update_interval_list()
-            self.status_display.setText("已清空所有时间节点")
+            self.status_display.setText("已清空所有时间节点" + self.push_schedule())
+
+    def push_schedule(self):
+        """运行中修改时间节点时推送给引擎，返回附加到状态栏的说明"""
+        if not (self.click_engine and self.click_engine.isRunning()):
+            return ""
+        if not self.interval_pattern:
+            return "\n时间节点为空，运行中继续使用原时间节点"
+        self.click_engine.swap_schedule(self.interval_pattern)
+        return "\n已应用到运行中的引擎"
 
     def update_interval_list(self):
         self.interval_list.clear()